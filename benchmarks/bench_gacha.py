@@ -0,0 +1,178 @@
+'''Benchmarks of RunnableGacha.
+
+Usage:
+    python benchmarks/bench_gacha.py
+'''
+import asyncio
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from langchain_core.runnables import (
+    Runnable,
+    RunnableConfig,
+    RunnableLambda,
+    RunnableParallel,
+)
+
+from runnable_family.gacha import RunnableGacha
+
+
+class _FakeEndpoint:
+    '''Async fake of a model endpoint with a fixed latency.'''
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.current = 0
+        self.peak = 0
+
+    async def __call__(self, x: int) -> int:
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+        await asyncio.sleep(self.latency)
+        self.current -= 1
+        return x
+
+
+class _FakeBatchEndpoint(Runnable[int, int]):
+    '''Fake of a model endpoint whose every request has a fixed overhead
+    whatever the number of the inputs is.
+    '''
+
+    def __init__(self, overhead: float):
+        self.overhead = overhead
+
+    def invoke(
+        self,
+        input: int,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> int:
+        time.sleep(self.overhead)
+        return input
+
+    def batch(  # type: ignore[override]
+        self,
+        inputs: list[int],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        **kwargs: Any,
+    ) -> list[int]:
+        time.sleep(self.overhead)
+        return list(inputs)
+
+    async def ainvoke(
+        self,
+        input: int,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> int:
+        await asyncio.sleep(self.overhead)
+        return input
+
+    async def abatch(  # type: ignore[override]
+        self,
+        inputs: list[int],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        **kwargs: Any,
+    ) -> list[int]:
+        await asyncio.sleep(self.overhead)
+        return list(inputs)
+
+
+def bench_ainvoke_max_concurrency(
+    n: int = 50,
+    latency: float = 0.02,
+    max_concurrencies: tuple[int | None, ...] = (1, 2, 5, 10, 25, 50, None),
+) -> None:
+    print(f'## ainvoke: n={n}, latency={latency}s')
+    print(f'{"max_concurrency":>16} {"elapsed[s]":>11} {"draws/s":>9} {"peak":>5}')  # noqa
+    for max_concurrency in max_concurrencies:
+        endpoint = _FakeEndpoint(latency)
+        chain = RunnableGacha(
+            RunnableLambda(endpoint),  # type: ignore
+            n=n,
+            max_concurrency=max_concurrency,
+        )
+        start = time.perf_counter()
+        asyncio.run(chain.ainvoke(0))
+        elapsed = time.perf_counter() - start
+        print(f'{str(max_concurrency):>16} {elapsed:>11.3f} {n / elapsed:>9.1f} {endpoint.peak:>5}')  # noqa
+
+
+def bench_dispatch(
+    ns: tuple[int, ...] = (10, 100, 1000),
+    overhead: float = 0.001,
+    max_concurrency: int | None = 8,
+) -> None:
+    print(f'## dispatch: overhead={overhead}s, max_concurrency={max_concurrency}')  # noqa
+    print(f'{"runnable":>9} {"dispatch":>8} {"n":>5} {"sync[us/draw]":>14} {"async[us/draw]":>15}')  # noqa
+    runnables: dict[str, Runnable[int, int]] = {
+        'lambda': RunnableLambda(lambda x: x),
+        'endpoint': _FakeBatchEndpoint(overhead),
+    }
+    for name, runnable in runnables.items():
+        for dispatch in ('invoke', 'batch'):
+            for n in ns:
+                chain = RunnableGacha(
+                    runnable,
+                    n=n,
+                    max_concurrency=max_concurrency,
+                    dispatch=dispatch,  # type: ignore
+                )
+                start = time.perf_counter()
+                chain.invoke(0)
+                sync_elapsed = time.perf_counter() - start
+                start = time.perf_counter()
+                asyncio.run(chain.ainvoke(0))
+                async_elapsed = time.perf_counter() - start
+                print(f'{name:>9} {dispatch:>8} {n:>5} {sync_elapsed / n * 1e6:>14.1f} {async_elapsed / n * 1e6:>15.1f}')  # noqa
+
+
+def _parallel_gacha(runnable: Runnable[int, int], n: int) -> Runnable[int, list[int]]:  # noqa
+    '''RunnableGacha as implemented with RunnableParallel for reference.'''
+    return (
+        RunnableParallel(**{str(i): runnable for i in range(n)})  # type: ignore # noqa
+        | RunnableLambda(lambda dic: dic.values())
+        | RunnableLambda(list)
+    )
+
+
+def _measure(func: Callable[[], Any]) -> tuple[Any, float, float]:
+    '''Returns the result, the elapsed time[s] and the peak memory[MB].'''
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 ** 2
+
+
+def bench_large_n(
+    ns: tuple[int, ...] = (100, 1000, 10000, 100000),
+    max_reference_n: int = 10000,
+    max_concurrency: int = 8,
+) -> None:
+    print(f'## large n: max_concurrency={max_concurrency}')
+    print(f'{"impl":>9} {"n":>7} {"build[s]":>9} {"build[MB]":>10} {"invoke[s]":>10} {"invoke[MB]":>11}')  # noqa
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x)
+    factories: dict[str, Callable[[int], Runnable[int, list[int]]]] = {
+        'parallel': lambda n: _parallel_gacha(runnable, n),
+        'gacha': lambda n: RunnableGacha(runnable, n=n),
+    }
+    for name, factory in factories.items():
+        for n in ns:
+            if name == 'parallel' and n > max_reference_n:
+                continue
+            chain, build_elapsed, build_peak = _measure(lambda: factory(n))
+            _, invoke_elapsed, invoke_peak = _measure(lambda: chain.invoke(
+                0,
+                {'max_concurrency': max_concurrency},
+            ))
+            print(f'{name:>9} {n:>7} {build_elapsed:>9.4f} {build_peak:>10.2f} {invoke_elapsed:>10.2f} {invoke_peak:>11.2f}')  # noqa
+
+
+if __name__ == '__main__':
+    bench_ainvoke_max_concurrency()
+    bench_dispatch()
+    bench_large_n()
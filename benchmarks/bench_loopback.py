@@ -0,0 +1,97 @@
+'''Benchmarks of RunnableLoopback.
+
+Usage:
+    python benchmarks/bench_loopback.py
+'''
+import time
+from typing import Callable
+
+from langchain_core.runnables import (
+    Runnable,
+    RunnableLambda,
+    RunnablePassthrough,
+)
+
+from runnable_family.loopback import RunnableLoopback, RunnableNLoop
+
+
+def bench_engine(
+    ns: tuple[int, ...] = (10, 100, 1000),
+    repeat: int = 3,
+) -> None:
+    print(f'## engine: repeat={repeat}')
+    print(f'{"engine":>7} {"n":>5} {"invoke[ms]":>11} {"us/iteration":>13}')  # noqa
+    for engine in ('graph', 'native'):
+        for n in ns:
+            chain = RunnableLoopback(
+                runnable=RunnableLambda(lambda x: x + 1),
+                condition=RunnableLambda(lambda x, n=n: x < n),
+                loopback=RunnablePassthrough(),
+                engine=engine,  # type: ignore
+            )
+            # NOTE: the graph engine takes 2 steps per iteration
+            config = {'recursion_limit': 2 * n + 1}
+            elapsed = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                assert chain.invoke(0, config) == n  # type: ignore
+                elapsed = min(elapsed, time.perf_counter() - start)
+            print(f'{engine:>7} {n:>5} {elapsed * 1e3:>11.2f} {elapsed / n * 1e6:>13.1f}')  # noqa
+
+
+def bench_n_loop(
+    ns: tuple[int, ...] = (2, 5, 10, 50),
+    repeat: int = 3,
+) -> None:
+    print(f'## n loop: repeat={repeat}')
+    print(f'{"impl":>18} {"n":>4} {"build[ms]":>10} {"invoke[ms]":>11}')  # noqa
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x + 1)
+    loopback: Runnable[int, int] = RunnablePassthrough()
+    factories: dict[str, Callable[[int], Runnable[int, int]]] = {
+        'with_n_loop': lambda n: RunnableLoopback.with_n_loop(n, runnable, loopback),  # noqa
+        'with_n_loop_native': lambda n: RunnableLoopback.with_n_loop(n, runnable, loopback, engine='native'),  # noqa
+        'n_loop': lambda n: RunnableNLoop(n, runnable, loopback),
+        'n_loop_unrolled': lambda n: RunnableNLoop.unrolled(n, runnable, loopback),  # noqa
+    }
+    for name, factory in factories.items():
+        for n in ns:
+            start = time.perf_counter()
+            chain = factory(n)
+            build_elapsed = time.perf_counter() - start
+            config = {'recursion_limit': 2 * n + 1}
+            elapsed = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                assert chain.invoke(0, config) == n  # type: ignore
+                elapsed = min(elapsed, time.perf_counter() - start)
+            print(f'{name:>18} {n:>4} {build_elapsed * 1e3:>10.2f} {elapsed * 1e3:>11.2f}')  # noqa
+
+
+def bench_construction(
+    n_instances: int = 200,
+) -> None:
+    print(f'## construction: n_instances={n_instances}')
+    print(f'{"impl":>12} {"build[ms/instance]":>19} {"first invoke[ms]":>17} {"next invoke[ms]":>16}')  # noqa
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x + 1)
+    loopback: Runnable[int, int] = RunnablePassthrough()
+    factories: dict[str, Callable[[], Runnable[int, int]]] = {
+        'loopback': lambda: RunnableLoopback(runnable, lambda x: x < 3, loopback),  # noqa
+        'with_n_loop': lambda: RunnableLoopback.with_n_loop(3, runnable, loopback),  # noqa
+    }
+    for name, factory in factories.items():
+        start = time.perf_counter()
+        chains = [factory() for _ in range(n_instances)]
+        build_elapsed = (time.perf_counter() - start) / n_instances
+        start = time.perf_counter()
+        assert chains[0].invoke(0) == 3
+        first_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        assert chains[0].invoke(0) == 3
+        next_elapsed = time.perf_counter() - start
+        print(f'{name:>12} {build_elapsed * 1e3:>19.3f} {first_elapsed * 1e3:>17.2f} {next_elapsed * 1e3:>16.2f}')  # noqa
+
+
+if __name__ == '__main__':
+    bench_engine()
+    bench_n_loop()
+    bench_construction()
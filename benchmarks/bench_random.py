@@ -0,0 +1,83 @@
+'''Benchmarks of RunnableRandomBranch.
+
+Usage:
+    python benchmarks/bench_random.py
+'''
+from functools import partial
+from itertools import accumulate
+import random
+import time
+from typing import Callable
+
+from langchain_core.runnables import (
+    Runnable,
+    RunnableBranch,
+    RunnableLambda,
+    RunnableMap,
+    RunnablePassthrough,
+    RunnablePick,
+)
+
+from runnable_family.random import RunnableRandomBranch
+
+
+def _is_ge_0_le_b(a: float, b: float) -> bool:
+    return 0 <= a <= b
+
+
+def _branch_reference(
+    runnables: list[Runnable[int, int]],
+    generate_random_value: Callable[[], float],
+) -> Runnable[int, int]:
+    '''RunnableRandomBranch as implemented with RunnableBranch for reference.
+    '''
+    cum_probs = list(accumulate([1. / len(runnables)] * len(runnables)))
+    return RunnableMap(
+        x=RunnablePassthrough(),
+        rv=RunnableLambda(lambda _: generate_random_value()),
+    ) | RunnableBranch(
+        *[
+            (
+                RunnablePick('rv') | RunnableLambda(partial(_is_ge_0_le_b, b=thresh)),  # noqa
+                RunnablePick('x') | runnable,
+            )
+            for runnable, thresh in zip(runnables, cum_probs)
+        ],
+        RunnableLambda(lambda _: -1),
+    )
+
+
+def bench_k(
+    ks: tuple[int, ...] = (2, 10, 100, 1000),
+    n_invokes: int = 20,
+    max_reference_k: int = 1000,
+) -> None:
+    print(f'## k: n_invokes={n_invokes}')
+    print(f'{"impl":>10} {"k":>5} {"build[ms]":>10} {"invoke[us]":>11}')
+    factories: dict[str, Callable[[list[Runnable[int, int]], Callable[[], float]], Runnable[int, int]]] = {  # noqa
+        'reference': _branch_reference,
+        'bisect': lambda runnables, generate_random_value: RunnableRandomBranch(  # noqa
+            *runnables,
+            generate_random_value=generate_random_value,
+        ),
+    }
+    for name, factory in factories.items():
+        for k in ks:
+            if name == 'reference' and k > max_reference_k:
+                continue
+            runnables: list[Runnable[int, int]] = [
+                RunnableLambda(lambda x, i=i: i) for i in range(k)
+            ]
+            rng = random.Random(0)
+            start = time.perf_counter()
+            chain = factory(runnables, rng.random)
+            build_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(n_invokes):
+                chain.invoke(0)
+            elapsed = (time.perf_counter() - start) / n_invokes
+            print(f'{name:>10} {k:>5} {build_elapsed * 1e3:>10.2f} {elapsed * 1e6:>11.1f}')  # noqa
+
+
+if __name__ == '__main__':
+    bench_k()
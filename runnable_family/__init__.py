@@ -1,6 +1,6 @@
 from .operator import RunnableAddConstant
 from .gacha import RunnableGacha
-from .loopback import RunnableLoopback
+from .loopback import RunnableBeamSearch, RunnableLoopback, RunnableNLoop
 from .random import RunnableRandomBranch
 from .runnable_diff import RunnableDiff
 from .self_consistent import RunnableSelfConsistent
@@ -13,6 +13,8 @@ __all__ = [
     RunnableConstant.__name__,
     RunnableAddConstant.__name__,
     RunnableLoopback.__name__,
+    RunnableNLoop.__name__,
+    RunnableBeamSearch.__name__,
     RunnableRandomBranch.__name__,
     RunnableGacha.__name__,
     RunnableDiff.__name__,
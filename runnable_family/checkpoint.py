@@ -0,0 +1,41 @@
+from contextlib import AbstractContextManager
+import os
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+
+def sqlite_checkpointer(
+    path: str | os.PathLike[str],
+) -> AbstractContextManager[BaseCheckpointSaver]:
+    '''Returns a context manager of a checkpointer which keeps the
+    checkpoints in a SQLite database on the local disk.
+
+    This is a shorthand of `SqliteSaver.from_conn_string`, which closes the
+    connection to the database when the context exits, so the checkpointer
+    must be used within the context. To keep the checkpoints in memory,
+    use `langgraph.checkpoint.memory.InMemorySaver` directly.
+
+    This requires `langgraph-checkpoint-sqlite`, which can be installed with
+    `pip install runnable_family[sqlite]`. The checkpointer supports only
+    the synchronous methods like `invoke` and `stream`.
+
+    Args:
+        path: Path to the SQLite database file. It is created if missing.
+
+    Raises:
+        ImportError: If `langgraph-checkpoint-sqlite` is not installed.
+
+    Example:
+        >>> from runnable_family.checkpoint import sqlite_checkpointer
+        >>> with sqlite_checkpointer(path) as checkpointer:  # doctest: +SKIP
+        ...     chain = RunnableLoopback(..., checkpointer=checkpointer)
+        ...     chain.invoke(input, {'configurable': {'thread_id': '1'}})
+    '''
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError as e:
+        raise ImportError(
+            'langgraph-checkpoint-sqlite is required for sqlite_checkpointer. '
+            'Install it with `pip install runnable_family[sqlite]`.'
+        ) from e
+    return SqliteSaver.from_conn_string(os.fspath(path))
@@ -1,13 +1,87 @@
+import asyncio
+from operator import itemgetter
+import os
+from queue import SimpleQueue
+import threading
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Generator,
+    Hashable,
+    Iterator,
+    Literal,
+    cast,
+)
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
+from langchain_core.callbacks.manager import (
+    adispatch_custom_event,
+    dispatch_custom_event,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.prompt_values import PromptValue
 from langchain_core.runnables import (
     Runnable,
-    RunnableLambda,
-    RunnableParallel,
-    RunnableSequence,
+    RunnableBinding,
+    RunnableConfig,
 )
 from langchain_core.runnables.base import Input, Output
+from langchain_core.runnables.config import (
+    ContextThreadPoolExecutor,
+    ensure_config,
+    get_async_callback_manager_for_config,
+    get_callback_manager_for_config,
+    get_config_list,
+    patch_config,
+)
+from langchain_core.runnables.configurable import DynamicRunnable
+
+from .random import derive_seed
+from .reducers import Reducer
+
+_DEFAULT_MAX_WORKERS: int = min(32, (os.cpu_count() or 1) + 4)
+'''Default number of the workers, which is the same as ThreadPoolExecutor.'''
+
+ATTEMPTS_EVENT_NAME: str = 'gacha_attempts'
+'''Name of the custom event reporting the number of the draws spent.'''
+
+DETERMINISTIC_CONFIG_KEY: str = 'gacha_deterministic'
+'''Key in `configurable` of the config to mark the runnable deterministic.'''
+
+
+class _DrawSchedule:
+    '''Schedule of the draws which redraws the duplicates within a budget.
+
+    Args:
+        n: The number of the draws in the first round.
+        max_attempts: The maximum number of the draws in total.
+    '''
 
+    def __init__(self, n: int, max_attempts: int):
+        self.n_attempts = 0
+        self._n_pending = n
+        self._max_attempts = max_attempts
 
-class RunnableGacha(RunnableSequence[Input, list[Output]]):
+    def next_indices(self) -> range:
+        '''Returns the indices of the draws in the next round.'''
+        start = self.n_attempts
+        self.n_attempts = min(start + self._n_pending, self._max_attempts)
+        self._n_pending = 0
+        return range(start, self.n_attempts)
+
+    def redraw(self) -> None:
+        '''Schedules a redraw in the next round.'''
+        self._n_pending += 1
+
+
+class RunnableGacha(Runnable[Input, list[Output]]):
     """Runnable that runs the same runnable multiple times in parallel.
     This is useful for scenarios where you want to gather multiple outputs
     from the same runnable, such as in a gacha system where you want to
@@ -17,14 +91,100 @@ class RunnableGacha(RunnableSequence[Input, list[Output]]):
     in the context of games or applications where users can draw random items
     or characters.
 
+    Each draw is traced with the tag `draw:i`. If the config has the seed
+    per call of `RunnableRandomBranch`, each draw gets a distinct seed
+    derived from it, so that the draws are not identical.
+
     Args:
         runnable: The runnable to run multiple times.
         n: The number of times to run the runnable in parallel.
             Default is 10.
+        max_concurrency: The maximum number of draws in flight at the same
+            time. If None, `max_concurrency` in the config is used, and if
+            it is not given either, the draws are limited to the default
+            number of the workers of `ThreadPoolExecutor`.
+            In `abatch`, the limit is shared by all the inputs.
+            Default is None.
+        k: The number of draws to wait for. If given, the runnable returns
+            as soon as `k` draws accepted by `predicate` have finished and
+            cancels the outstanding draws. If None, all the `n` draws run.
+            Default is None.
+        predicate: A callable that determines whether the output of a draw
+            is accepted. The outputs not accepted are dropped. If None, all
+            the outputs are accepted.
+            Default is None.
+        dispatch: How to dispatch the draws to `runnable`.
+            If 'invoke', each draw is a separate `invoke` (`ainvoke`) call.
+            If 'batch', the draws are sent as one
+            `runnable.batch([input] * n)` (`abatch`) call with
+            `max_concurrency`, which is cheaper for runnables with an
+            efficient batch implementation like chat models or retrievers.
+            Note that the outputs are available only after the whole batch
+            finishes, so `k` and `predicate` only filter them, and that
+            the limit of `max_concurrency` is not shared among the inputs
+            of `abatch`.
+            If 'multi_sample', the draws are generated by one request
+            which returns `n` completions. This requires `runnable` to be
+            a chat model accepting `n` as a keyword argument of the request
+            like `ChatOpenAI`, and the outputs are the messages of the
+            completions. If the model returns fewer completions than
+            requested, the rest are drawn as in 'invoke'.
+            If 'auto', 'multi_sample' is used if `runnable` is detected to
+            support it, i.e. it is a chat model with the field `n` and
+            without streaming, and otherwise 'invoke' is used.
+            Default is 'invoke'.
+        unique_key: A callable that returns a hashable key of the output of
+            a draw. If given, the outputs are made unique by the key: a draw
+            whose key has already been seen is dropped and drawn again, so
+            that only the duplicate slots cost extra draws. The number of
+            the draws spent is reported as the custom event
+            `gacha_attempts` with the data
+            `{'n_attempts': ..., 'n_outputs': ...}`.
+            Default is None.
+        max_attempts: The maximum number of draws including the redraws of
+            duplicates. It is used only when `unique_key` is given, and
+            fewer than `n` outputs are returned if it is exhausted.
+            If None, `2 * n` is used.
+            Default is None.
+        reducer: An incremental reducer which folds the output of each draw
+            as soon as the draw finishes, e.g. `CountReducer`,
+            `MeanVarianceReducer` or `TopKReducer` in
+            `runnable_family.reducers`. If given, the runnable returns the
+            result of the reducer instead of the list of the outputs, and
+            the outputs are dropped after folded, so the memory does not
+            grow with `n`. Since the outputs are folded in the order of
+            completion, the reducer should not depend on the order.
+            Note that `dispatch='batch'` and `'multi_sample'` receive all
+            the outputs of a round at once, so the outputs are materialized
+            before folded and the memory is bounded only with 'invoke'.
+            Default is None.
+        deterministic: Whether `runnable` is deterministic. If True, the
+            runnable is evaluated only once and its output is replicated
+            `n` times, i.e. the same object is repeated. If 'auto', the
+            runnable is regarded as deterministic when its `temperature`
+            is 0, which is resolved per call for runnables configured with
+            `configurable_fields` or `bind`.
+            This can be overridden per call by setting
+            `{'configurable': {'gacha_deterministic': True or False}}`
+            in the config.
+            Default is False.
     Attributes:
-        _chain (Runnable[Input, Output]): The chain of runnables that runs
-            the same runnable `n` times in parallel and collects the results
-            into a list.
+        _runnable (Runnable[Input, Output]): The runnable to draw.
+        _n (int): The number of draws.
+        _max_concurrency (int | None): The maximum number of draws in flight.
+        _k (int | None): The number of accepted draws to wait for.
+        _predicate (Callable[[Output], bool] | None): The predicate to accept
+            the output of a draw.
+        _dispatch (Literal['invoke', 'batch', 'multi_sample']): How to
+            dispatch the draws.
+        _unique_key (Callable[[Output], Hashable] | None): The key function
+            to identify the duplicate outputs.
+        _max_attempts (int | None): The maximum number of draws including
+            the redraws of duplicates.
+        _reducer (Reducer[Output, Any, Any] | None): The reducer to fold
+            the outputs of the draws.
+        _deterministic (bool | Literal['auto']): Whether the runnable is
+            deterministic.
     Example:
         >>> from runnable_family.gacha import RunnableGacha
         >>> from langchain_core.runnables import RunnableLambda
@@ -35,15 +195,795 @@ class RunnableGacha(RunnableSequence[Input, list[Output]]):
         >>> print(results)  # Output: [20, 20, 20, 20, 20]
         [20, 20, 20, 20, 20]
         >>> # This will run `my_runnable` 5 times in parallel with input 10
+        >>> for i, result in gacha_runnable.stream_draws(10):
+        ...     print(i, result)  # doctest: +SKIP
+        3 20
+        0 20
+        ...
+        >>> # `stream_draws` yields the pairs of the index and the output of
+        >>> # each draw in the order of completion
+        >>> first_one = RunnableGacha(RunnableLambda(my_runnable), n=5, k=1)
+        >>> print(first_one.invoke(10))
+        [20]
+        >>> # This returns as soon as the first draw finishes
+        >>> from runnable_family.reducers import CountReducer
+        >>> histogram = RunnableGacha(
+        ...     RunnableLambda(my_runnable),
+        ...     n=5,
+        ...     reducer=CountReducer(),
+        ... )
+        >>> print(histogram.invoke(10))
+        Counter({20: 5})
+
+    Note:
+        Only `stream_draws` and `astream_draws` yield the draws one by one.
+        `stream`, `astream`, `transform` and `atransform` yield the whole
+        list of the outputs as one chunk so that the downstream runnables
+        receive `list[Output]`.
+
+        When `k` or `predicate` is given, the output may contain fewer than
+        `n` elements: the accepted outputs are returned in the order of the
+        draw index, and fewer than `k` of them are returned if not enough
+        draws are accepted.
+        On the sync paths, draws already running in the thread pool cannot
+        be interrupted; they are left to finish in the background and their
+        outputs are discarded.
+
+        The draws are pulled by a fixed number of workers, whose number is
+        `max_concurrency` if given, so neither graph nodes nor futures nor
+        tasks are materialized per draw, which keeps a large `n` such as
+        100,000 cheap to build and to run.
     """
 
+    _runnable: Runnable[Input, Output]
+    '''Runnable to draw.'''
+    _n: int
+    '''Number of draws.'''
+    _max_concurrency: int | None
+    '''Maximum number of draws in flight.'''
+    _k: int | None
+    '''Number of accepted draws to wait for.'''
+    _predicate: Callable[[Output], bool] | None
+    '''Predicate to accept the output of a draw.'''
+    _dispatch: Literal['invoke', 'batch', 'multi_sample']
+    '''How to dispatch the draws.'''
+    _unique_key: Callable[[Output], Hashable] | None
+    '''Key function to identify the duplicate outputs.'''
+    _max_attempts: int | None
+    '''Maximum number of draws including the redraws of duplicates.'''
+    _reducer: Reducer[Output, Any, Any] | None
+    '''Reducer to fold the outputs of the draws.'''
+    _deterministic: bool | Literal['auto']
+    '''Whether the runnable is deterministic.'''
+
     def __init__(
         self,
         runnable: Runnable[Input, Output],
         n: int = 10,
+        max_concurrency: int | None = None,
+        k: int | None = None,
+        predicate: Callable[[Output], bool] | None = None,
+        dispatch: Literal['invoke', 'batch', 'multi_sample', 'auto'] = 'invoke',  # noqa
+        unique_key: Callable[[Output], Hashable] | None = None,
+        max_attempts: int | None = None,
+        reducer: Reducer[Output, Any, Any] | None = None,
+        deterministic: bool | Literal['auto'] = False,
     ):
-        super().__init__(
-            RunnableParallel(**{str(i): runnable for i in range(n)}).with_types(input_type=runnable.InputType),  # type: ignore # noqa
-            RunnableLambda(lambda dic: dic.values()),
-            RunnableLambda(list).with_types(output_type=list[runnable.OutputType]),  # type: ignore # noqa
+        if n < 0:
+            raise ValueError(f'n must be non-negative: n={n}')
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f'max_concurrency must be positive: max_concurrency={max_concurrency}')  # noqa
+        if k is not None and k < 1:
+            raise ValueError(f'k must be positive: k={k}')
+        if dispatch not in ('invoke', 'batch', 'multi_sample', 'auto'):
+            raise ValueError(f"dispatch must be 'invoke', 'batch', 'multi_sample' or 'auto': dispatch={dispatch}")  # noqa
+        if dispatch == 'multi_sample' and not isinstance(runnable, BaseChatModel):  # noqa
+            raise ValueError(f"dispatch='multi_sample' requires a chat model: runnable={runnable}")  # noqa
+        if max_attempts is not None and max_attempts < n:
+            raise ValueError(f'max_attempts must be greater than or equal to n: max_attempts={max_attempts}, n={n}')  # noqa
+        if dispatch == 'auto':
+            dispatch = 'multi_sample' if self._supports_multi_sample(runnable) else 'invoke'  # noqa
+        self._runnable = runnable
+        self._n = n
+        self._max_concurrency = max_concurrency
+        self._k = k
+        self._predicate = predicate
+        self._dispatch = dispatch
+        self._unique_key = unique_key
+        self._max_attempts = max_attempts
+        self._reducer = reducer
+        self._deterministic = deterministic
+
+    @staticmethod
+    def _supports_multi_sample(runnable: Runnable[Input, Output]) -> bool:
+        return (
+            isinstance(runnable, BaseChatModel)
+            and 'n' in type(runnable).model_fields
+            and not getattr(runnable, 'streaming', False)
+        )
+
+    def _get_max_concurrency(self, config: RunnableConfig) -> int | None:
+        if self._max_concurrency is not None:
+            return self._max_concurrency
+        return config.get('max_concurrency')
+
+    def _accepts(self, output: Output) -> bool:  # type: ignore[misc]
+        return self._predicate is None or self._predicate(output)
+
+    def _is_duplicate(self, output: Output, seen: set[Hashable]) -> bool:  # type: ignore[misc] # noqa
+        if self._unique_key is None:
+            return False
+        key = self._unique_key(output)
+        if key in seen:
+            return True
+        seen.add(key)
+        return False
+
+    def _new_schedule(self, deterministic: bool) -> '_DrawSchedule':
+        if self._unique_key is None:
+            return _DrawSchedule(self._n, self._n)
+        if deterministic:
+            # NOTE: redrawing a deterministic runnable never gives
+            #       another unique output.
+            return _DrawSchedule(min(self._n, 1), 1)
+        return _DrawSchedule(self._n, self._max_attempts or 2 * self._n)
+
+    def _is_deterministic(self, config: RunnableConfig) -> bool:
+        configured = config.get('configurable', {}).get(DETERMINISTIC_CONFIG_KEY)  # noqa
+        if configured is not None:
+            return bool(configured)
+        if self._deterministic == 'auto':
+            return self._detect_deterministic(self._runnable, config)
+        return self._deterministic
+
+    @staticmethod
+    def _detect_deterministic(
+        runnable: Runnable[Input, Output],
+        config: RunnableConfig,
+    ) -> bool:
+        if isinstance(runnable, DynamicRunnable):
+            runnable, config = runnable.prepare(config)
+        if isinstance(runnable, RunnableBinding):
+            if 'temperature' in runnable.kwargs:
+                return bool(runnable.kwargs['temperature'] == 0)
+            runnable = runnable.bound
+        return getattr(runnable, 'temperature', None) == 0
+
+    def _is_enough(self, n_accepted: int) -> bool:
+        return self._k is not None and n_accepted >= self._k
+
+    def _draw_config(
+        self,
+        config: RunnableConfig,
+        run_manager: CallbackManagerForChainRun | AsyncCallbackManagerForChainRun,  # noqa
+        i: int | str,
+    ) -> RunnableConfig:
+        return patch_config(
+            derive_seed(config, i),
+            callbacks=run_manager.get_child(f'draw:{i}'),
+        )
+
+    def invoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> list[Output] | Any:
+        '''Returns the list of the outputs, or the result of the reducer
+        if `reducer` is given.
+        '''
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    def _invoke(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Any:
+        acc = self._initial()
+        for draw in self._iter_draws(input, run_manager, config, **kwargs):
+            acc = self._fold(acc, draw)
+        return self._result(acc)
+
+    def _iter_draws(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Iterator[tuple[int, Output]]:
+        '''Yields the pairs of the index and the output of each accepted
+        draw in the order of completion.
+        '''
+        n_accepted = 0
+        seen: set[Hashable] = set()
+        deterministic = self._is_deterministic(config)
+        schedule = self._new_schedule(deterministic)
+        while (indices := schedule.next_indices()):
+            if deterministic:
+                draws = self._replicate_draws(
+                    input,
+                    run_manager,
+                    config,
+                    indices,
+                    **kwargs,
+                )
+            else:
+                draws = self._dispatch_draws(
+                    input,
+                    run_manager,
+                    config,
+                    indices,
+                    **kwargs,
+                )
+            try:
+                for i, output in draws:
+                    if not self._accepts(output):
+                        continue
+                    if self._is_duplicate(output, seen):
+                        schedule.redraw()
+                        continue
+                    n_accepted += 1
+                    yield i, output
+                    if self._is_enough(n_accepted):
+                        break
+            finally:
+                draws.close()
+            if self._is_enough(n_accepted):
+                break
+        if self._unique_key is not None:
+            dispatch_custom_event(
+                ATTEMPTS_EVENT_NAME,
+                {'n_attempts': schedule.n_attempts, 'n_outputs': n_accepted},
+                config=patch_config(config, callbacks=run_manager.get_child()),  # noqa
+            )
+
+    def _dispatch_draws(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> Generator[tuple[int, Output], None, None]:
+        if self._dispatch == 'batch':
+            return self._batch_draws(
+                input,
+                run_manager,
+                config,
+                indices,
+                **kwargs,
+            )
+        elif self._dispatch == 'multi_sample':
+            return self._multi_sample_draws(
+                input,
+                run_manager,
+                config,
+                indices,
+                **kwargs,
+            )
+        else:
+            return self._invoke_draws(
+                input,
+                run_manager,
+                config,
+                indices,
+                **kwargs,
+            )
+
+    def _replicate_draws(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> Generator[tuple[int, Output], None, None]:
+        output = self._runnable.invoke(
+            input,
+            self._draw_config(config, run_manager, indices.start),
+            **kwargs,
+        )
+        for i in indices:
+            yield i, output
+
+    def _invoke_draws(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> Generator[tuple[int, Output], None, None]:
+        # NOTE: a fixed number of workers pull the indices of the draws
+        #       so that neither n futures nor n thread-pool tasks are
+        #       materialized for a large n.
+        pending = iter(indices)
+        lock = threading.Lock()
+        stopped = threading.Event()
+        results: SimpleQueue[tuple[int, Any, BaseException | None]] = SimpleQueue()  # noqa
+
+        def work() -> None:
+            while not stopped.is_set():
+                with lock:
+                    i = next(pending, None)
+                if i is None:
+                    return
+                try:
+                    output = self._runnable.invoke(
+                        input,
+                        self._draw_config(config, run_manager, i),
+                        **kwargs,
+                    )
+                except BaseException as e:
+                    results.put((i, None, e))
+                    return
+                results.put((i, output, None))
+
+        n_workers = min(
+            self._get_max_concurrency(config) or _DEFAULT_MAX_WORKERS,
+            len(indices),
         )
+        executor = ContextThreadPoolExecutor(max_workers=max(n_workers, 1))
+        try:
+            for _ in range(n_workers):
+                executor.submit(work)
+            for _ in indices:
+                i, output, error = results.get()
+                if error is not None:
+                    raise error
+                yield i, output
+        finally:
+            # stop pulling the draws without waiting for the running ones
+            # when enough draws are accepted, an error occurs or
+            # the consumer stops iterating
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _batch_draws(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> Generator[tuple[int, Output], None, None]:
+        yield from zip(indices, self._runnable.batch(
+            [input] * len(indices),
+            self._batch_configs(config, run_manager, indices),
+            **kwargs,
+        ))
+
+    def _multi_sample_draws(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> Generator[tuple[int, Output], None, None]:
+        model = cast(BaseChatModel, self._runnable)
+        draw_config = self._draw_config(config, run_manager, 'multi_sample')
+        result = model.generate_prompt(
+            [self._to_prompt(model, input)],
+            callbacks=draw_config.get('callbacks'),
+            tags=draw_config.get('tags'),
+            metadata=draw_config.get('metadata'),
+            **{**kwargs, 'n': len(indices)},
+        )
+        messages = list(self._messages(result))
+        yield from zip(indices, messages)
+        # NOTE: the model may return fewer completions than requested, e.g.
+        #       when it ignores `n` or takes its streaming path, so the rest
+        #       of the draws are invoked one by one.
+        if len(messages) < len(indices):
+            yield from self._invoke_draws(
+                input,
+                run_manager,
+                config,
+                indices[len(messages):],
+                **kwargs,
+            )
+
+    def _batch_configs(
+        self,
+        config: RunnableConfig,
+        run_manager: CallbackManagerForChainRun | AsyncCallbackManagerForChainRun,  # noqa
+        indices: range,
+    ) -> list[RunnableConfig]:
+        max_concurrency = self._get_max_concurrency(config)
+        return [
+            patch_config(
+                self._draw_config(config, run_manager, i),
+                max_concurrency=max_concurrency,
+            )
+            for i in indices
+        ]
+
+    @staticmethod
+    def _to_prompt(model: BaseChatModel, input: Input) -> PromptValue:
+        '''Converts the input into the prompt in the same way as
+        `model.invoke`.
+        '''
+        # NOTE: langchain_core has no public API to convert the input of
+        #       a chat model, so the private method used by `invoke` is
+        #       called only here.
+        return model._convert_input(input)  # type: ignore
+
+    @staticmethod
+    def _messages(result: LLMResult) -> Iterator[Output]:
+        for generation in result.generations[0]:
+            yield cast(ChatGeneration, generation).message  # type: ignore
+
+    async def ainvoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> list[Output] | Any:
+        '''Returns the list of the outputs, or the result of the reducer
+        if `reducer` is given.
+        '''
+        return await self._acall_with_config(
+            self._ainvoke,
+            input,
+            config,
+            **kwargs,
+        )
+
+    async def _ainvoke(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        semaphore: asyncio.Semaphore | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        acc = self._initial()
+        async for draw in self._aiter_draws(
+            input,
+            run_manager,
+            config,
+            semaphore,
+            **kwargs,
+        ):
+            acc = self._fold(acc, draw)
+        return self._result(acc)
+
+    async def _aiter_draws(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        semaphore: asyncio.Semaphore | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[tuple[int, Output]]:
+        '''Yields the pairs of the index and the output of each accepted
+        draw in the order of completion.
+        '''
+        n_accepted = 0
+        seen: set[Hashable] = set()
+        deterministic = self._is_deterministic(config)
+        schedule = self._new_schedule(deterministic)
+        while (indices := schedule.next_indices()):
+            if deterministic:
+                draws = self._areplicate_draws(
+                    input,
+                    run_manager,
+                    config,
+                    indices,
+                    **kwargs,
+                )
+            else:
+                draws = self._adispatch_draws(
+                    input,
+                    run_manager,
+                    config,
+                    indices,
+                    semaphore,
+                    **kwargs,
+                )
+            try:
+                async for i, output in draws:
+                    if not self._accepts(output):
+                        continue
+                    if self._is_duplicate(output, seen):
+                        schedule.redraw()
+                        continue
+                    n_accepted += 1
+                    yield i, output
+                    if self._is_enough(n_accepted):
+                        break
+            finally:
+                await draws.aclose()
+            if self._is_enough(n_accepted):
+                break
+        if self._unique_key is not None:
+            await adispatch_custom_event(
+                ATTEMPTS_EVENT_NAME,
+                {'n_attempts': schedule.n_attempts, 'n_outputs': n_accepted},
+                config=patch_config(config, callbacks=run_manager.get_child()),  # noqa
+            )
+
+    def _adispatch_draws(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        semaphore: asyncio.Semaphore | None = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[tuple[int, Output], None]:
+        if self._dispatch == 'batch':
+            return self._abatch_draws(
+                input,
+                run_manager,
+                config,
+                indices,
+                **kwargs,
+            )
+        elif self._dispatch == 'multi_sample':
+            return self._amulti_sample_draws(
+                input,
+                run_manager,
+                config,
+                indices,
+                **kwargs,
+            )
+        else:
+            return self._ainvoke_draws(
+                input,
+                run_manager,
+                config,
+                indices,
+                semaphore,
+                **kwargs,
+            )
+
+    async def _areplicate_draws(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> AsyncGenerator[tuple[int, Output], None]:
+        output = await self._runnable.ainvoke(
+            input,
+            self._draw_config(config, run_manager, indices.start),
+            **kwargs,
+        )
+        for i in indices:
+            yield i, output
+
+    async def _ainvoke_draws(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        semaphore: asyncio.Semaphore | None = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[tuple[int, Output], None]:
+        # NOTE: a fixed number of workers pull the indices of the draws
+        #       so that n tasks are not materialized for a large n.
+        pending = iter(indices)
+        results: asyncio.Queue[tuple[int, Any, BaseException | None]] = asyncio.Queue()  # noqa
+
+        async def work() -> None:
+            for i in pending:
+                try:
+                    output = await self._gated(
+                        semaphore,
+                        self._runnable.ainvoke(
+                            input,
+                            self._draw_config(config, run_manager, i),
+                            **kwargs,
+                        ),
+                    )
+                except Exception as e:
+                    results.put_nowait((i, None, e))
+                    return
+                results.put_nowait((i, output, None))
+
+        n_workers = min(
+            self._get_max_concurrency(config) or _DEFAULT_MAX_WORKERS,
+            len(indices),
+        )
+        tasks = [asyncio.create_task(work()) for _ in range(n_workers)]
+        try:
+            for _ in indices:
+                i, output, error = await results.get()
+                if error is not None:
+                    raise error
+                yield i, output
+        finally:
+            # cancel the outstanding draws when enough draws are accepted,
+            # an error occurs or the consumer stops iterating
+            for task in tasks:
+                task.cancel()
+
+    async def _abatch_draws(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> AsyncGenerator[tuple[int, Output], None]:
+        outputs = await self._runnable.abatch(
+            [input] * len(indices),
+            self._batch_configs(config, run_manager, indices),
+            **kwargs,
+        )
+        for draw in zip(indices, outputs):
+            yield draw
+
+    async def _amulti_sample_draws(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        indices: range,
+        **kwargs: Any,
+    ) -> AsyncGenerator[tuple[int, Output], None]:
+        model = cast(BaseChatModel, self._runnable)
+        draw_config = self._draw_config(config, run_manager, 'multi_sample')
+        result = await model.agenerate_prompt(
+            [self._to_prompt(model, input)],
+            callbacks=draw_config.get('callbacks'),
+            tags=draw_config.get('tags'),
+            metadata=draw_config.get('metadata'),
+            **{**kwargs, 'n': len(indices)},
+        )
+        messages = list(self._messages(result))
+        for draw in zip(indices, messages):
+            yield draw
+        # NOTE: the rest of the draws are invoked one by one as in the sync
+        #       path if the model returns fewer completions than requested
+        if len(messages) < len(indices):
+            async for draw in self._ainvoke_draws(
+                input,
+                run_manager,
+                config,
+                indices[len(messages):],
+                **kwargs,
+            ):
+                yield draw
+
+    async def abatch(
+        self,
+        inputs: list[Input],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[list[Output] | Any]:
+        if not inputs:
+            return []
+        configs = get_config_list(config, len(inputs))
+        # NOTE: the draws of all the inputs share one limit
+        #       so that the endpoint of the runnable is not flooded.
+        max_concurrency = self._get_max_concurrency(configs[0])
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None  # noqa
+
+        async def ainvoke(
+            input: Input,
+            config: RunnableConfig,
+        ) -> list[Output] | Any:
+            try:
+                return await self._acall_with_config(
+                    self._ainvoke,
+                    input,
+                    config,
+                    semaphore=semaphore,
+                    **kwargs,
+                )
+            except Exception as e:
+                if return_exceptions:
+                    return e
+                raise
+
+        return await asyncio.gather(*(  # type: ignore
+            ainvoke(input, config)
+            for input, config in zip(inputs, configs)
+        ))
+
+    @staticmethod
+    async def _gated(
+        semaphore: asyncio.Semaphore | None,
+        coro: Coroutine[Any, Any, Output],
+    ) -> Output:
+        if semaphore is None:
+            return await coro
+        async with semaphore:
+            return await coro
+
+    def stream_draws(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Iterator[tuple[int, Output]]:
+        '''Yields the pairs of the index and the output of each draw
+        as soon as the draw finishes.
+        '''
+        config = ensure_config(config)
+        callback_manager = get_callback_manager_for_config(config)
+        run_manager = callback_manager.on_chain_start(
+            None,
+            input,
+            name=config.get('run_name') or self.get_name(),
+            run_id=config.pop('run_id', None),
+        )
+        acc = self._initial()
+        try:
+            for draw in self._iter_draws(input, run_manager, config, **kwargs):  # noqa
+                acc = self._fold(acc, draw)
+                yield draw
+        except BaseException as e:
+            run_manager.on_chain_error(e)
+            raise
+        else:
+            run_manager.on_chain_end(self._result(acc))
+
+    async def astream_draws(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[tuple[int, Output]]:
+        '''Yields the pairs of the index and the output of each draw
+        as soon as the draw finishes.
+        '''
+        config = ensure_config(config)
+        callback_manager = get_async_callback_manager_for_config(config)
+        run_manager = await callback_manager.on_chain_start(
+            None,
+            input,
+            name=config.get('run_name') or self.get_name(),
+            run_id=config.pop('run_id', None),
+        )
+        acc = self._initial()
+        try:
+            async for draw in self._aiter_draws(
+                input,
+                run_manager,
+                config,
+                **kwargs,
+            ):
+                acc = self._fold(acc, draw)
+                yield draw
+        except BaseException as e:
+            await run_manager.on_chain_error(e)
+            raise
+        else:
+            await run_manager.on_chain_end(self._result(acc))
+
+    def _initial(self) -> Any:
+        if self._reducer is None:
+            return []
+        return self._reducer.initial()
+
+    def _fold(self, acc: Any, draw: tuple[int, Output]) -> Any:  # type: ignore[misc] # noqa
+        if self._reducer is None:
+            acc.append(draw)
+            return acc
+        # NOTE: the draw is dropped after folded into the accumulator
+        return self._reducer.fold(acc, draw[1])
+
+    def _result(self, acc: Any) -> Any:
+        if self._reducer is None:
+            return [output for _, output in sorted(acc, key=itemgetter(0))]
+        return self._reducer.result(acc)
+
+    @property
+    def InputType(self) -> type[Input]:
+        return self._runnable.InputType
+
+    @property
+    def OutputType(self) -> Any:
+        if self._reducer is not None:
+            return self._reducer.ResultType
+        return list[self._runnable.OutputType]  # type: ignore
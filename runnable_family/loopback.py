@@ -1,8 +1,25 @@
-from operator import itemgetter
-from typing import TYPE_CHECKING, Callable, TypedDict, cast
+from collections import OrderedDict
+from functools import cache, cached_property, partial
+import heapq
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Hashable,
+    Iterator,
+    Literal,
+    TypedDict,
+    cast,
+)
 from uuid import uuid4
 
 import langchain
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    CallbackManagerForChainRun,
+)
 from langchain_core.runnables import (
     Runnable,
     RunnableBranch,
@@ -10,9 +27,17 @@ from langchain_core.runnables import (
     RunnableLambda,
     RunnablePassthrough,
     RunnableParallel,
+    RunnableSequence,
 )
 from langchain_core.runnables.base import Input, Output
+from langchain_core.runnables.config import (
+    ensure_config,
+    get_async_callback_manager_for_config,
+    get_callback_manager_for_config,
+    patch_config,
+)
 import langchain_core.runnables.graph
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, END
 from langgraph.graph.state import CompiledStateGraph
 
@@ -28,6 +53,92 @@ elif langchain.__version__ < '0.3.0':
 else:
     from pydantic import create_model  # type: ignore
 
+_MISSING = object()
+'''Sentinel of a missing memo.'''
+
+_COMPONENTS_KEY = '__runnable_loopback'
+'''Key in `configurable` of the config to pass the loopback to the graph.'''
+
+
+class LoopbackCycleError(RuntimeError):
+    '''Raised when the output of `RunnableLoopback` repeats with
+    `on_repeat='raise'`.
+    '''
+
+
+class _InternalStateSchema(TypedDict):
+    input: Any
+    output: Any
+
+
+def _get_loopback(
+    config: RunnableConfig,
+) -> tuple['RunnableLoopback', RunnableConfig]:
+    '''Returns the loopback in the config and the config without it,
+    which is passed to the components so that they do not see the loopback.
+    '''
+    configurable = dict(config['configurable'])
+    loopback = cast(RunnableLoopback, configurable.pop(_COMPONENTS_KEY))
+    return loopback, cast(RunnableConfig, {**config, 'configurable': configurable})  # noqa
+
+
+def _run_runnable(state: _InternalStateSchema, config: RunnableConfig) -> dict:  # noqa
+    loopback, config = _get_loopback(config)
+    return {'output': loopback._runnable.invoke(state['input'], config)}
+
+
+async def _arun_runnable(state: _InternalStateSchema, config: RunnableConfig) -> dict:  # noqa
+    loopback, config = _get_loopback(config)
+    return {'output': await loopback._runnable.ainvoke(state['input'], config)}  # noqa
+
+
+def _run_loopback(state: _InternalStateSchema, config: RunnableConfig) -> dict:  # noqa
+    loopback, config = _get_loopback(config)
+    return {'input': loopback._loopback.invoke(state['output'], config)}
+
+
+async def _arun_loopback(state: _InternalStateSchema, config: RunnableConfig) -> dict:  # noqa
+    loopback, config = _get_loopback(config)
+    return {'input': await loopback._loopback.ainvoke(state['output'], config)}  # noqa
+
+
+def _route(state: _InternalStateSchema, config: RunnableConfig) -> str:
+    loopback, config = _get_loopback(config)
+    return 'continue' if loopback._condition.invoke(state['output'], config) else 'end'  # noqa
+
+
+async def _aroute(state: _InternalStateSchema, config: RunnableConfig) -> str:  # noqa
+    loopback, config = _get_loopback(config)
+    return 'continue' if await loopback._condition.ainvoke(state['output'], config) else 'end'  # noqa
+
+
+def _build_graph() -> StateGraph:
+    '''Builds the graph of the loop, whose components are read from
+    the config at runtime.
+    '''
+    graph = StateGraph(_InternalStateSchema)
+    graph.add_node('runnable', RunnableLambda(_run_runnable, afunc=_arun_runnable))  # noqa
+    graph.add_node('loopback', RunnableLambda(_run_loopback, afunc=_arun_loopback))  # noqa
+    graph.add_conditional_edges(
+        'runnable',
+        RunnableLambda(_route, afunc=_aroute),
+        {
+            'continue': 'loopback',
+            'end': END,
+        },
+    )
+    graph.add_edge('loopback', 'runnable')
+    graph.set_entry_point('runnable')
+    return graph
+
+
+@cache
+def _graph_template() -> CompiledStateGraph:
+    '''Returns the compiled graph shared by the loopbacks without
+    a checkpointer.
+    '''
+    return _build_graph().compile()
+
 
 class RunnableLoopback(Runnable[Input, Output]):
     """Runnable that loops back the output to the input until a condition is met.
@@ -44,12 +155,69 @@ class RunnableLoopback(Runnable[Input, Output]):
         loopback (Runnable[Output, Input]): A runnable that takes the output
             of the main runnable and transforms it back into the input format
             for the next iteration.
+        engine (Literal['graph', 'native']): Engine to run the loop.
+            'graph' runs the loop as a compiled LangGraph graph, so the
+            number of the iterations is limited by `recursion_limit` in the
+            config. 'native' runs the loop in a plain while loop, which
+            skips the overhead of the graph per iteration and does not limit
+            the number of the iterations. The runnable, the condition and
+            the loopback in the i-th iteration are traced with the tag
+            `iteration:i`.
+            Default is 'graph'.
+        checkpointer (BaseCheckpointSaver | None): Checkpointer to save the
+            state after each step of the loop, e.g.
+            `langgraph.checkpoint.memory.InMemorySaver` or the one given by
+            the context manager
+            `runnable_family.checkpoint.sqlite_checkpointer`.
+            The checkpoints are keyed by `thread_id` in `configurable` of
+            the config, which is required when a checkpointer is given.
+            If the last run on the thread failed or was interrupted, the
+            next run on the thread resumes from the last completed step
+            and its input is ignored. Only engine='graph' supports this.
+            Default is None.
+        batch_mode (Literal['independent', 'lockstep']): Mode to run
+            `batch` and `abatch`. 'independent' runs the loop of each input
+            independently. 'lockstep' advances all the active inputs by one
+            iteration at a time, calling `batch` of the runnable, the
+            condition and the loopback once per iteration on them, and drops
+            the inputs whose condition is False, so that loops of different
+            lengths share the batched calls. The i-th iteration is traced
+            with the tag `iteration:i` like engine='native'.
+            Default is 'independent'.
+        fingerprint (Callable[[Output], Hashable] | None): Function to
+            return the hashable fingerprint of the output of `runnable`,
+            e.g. `str` or `lambda output: output.content`. If given, the loop
+            stops when the fingerprint of the output repeats in the run,
+            i.e. when the loop reaches a fixed point or a cycle, and the
+            repeated output is returned. Only engine='native' with
+            batch_mode='independent' supports this.
+            Default is None.
+        max_fingerprints (int): Maximum number of the fingerprints kept per
+            run and in the memo of the loopback. The oldest ones are dropped
+            first, so a cycle longer than this is not detected.
+            Default is 1024.
+        on_repeat (Literal['stop', 'raise']): 'stop' returns the repeated
+            output, and 'raise' raises `LoopbackCycleError`.
+            Default is 'stop'.
+        memoize_loopback (bool): Whether to memoize the outputs of
+            `loopback` by the fingerprints of its inputs across the runs, so
+            that the loopback of a known state is not recomputed. This
+            requires `fingerprint` and assumes `loopback` is deterministic.
+            Default is False.
 
     Attributes:
-        _graph (CompiledStateGraph): Compiled graph of the runnable.
+        _graph (CompiledStateGraph): Compiled graph of the runnable, which
+            is compiled lazily and shared among the loopbacks.
         _runnable (Runnable[Input, Output]): The main runnable to be looped back.
         _condition (Runnable[Output, bool]): Condition to determine if looping continues.
         _loopback (Runnable[Output, Input]): Runnable to transform output back to input.
+        _engine (Literal['graph', 'native']): Engine to run the loop.
+        _checkpointer (BaseCheckpointSaver | None): Checkpointer of the graph.
+        _batch_mode (Literal['independent', 'lockstep']): Mode to run batch.
+        _fingerprint (Callable[[Output], Hashable] | None): Fingerprint of the output.
+        _max_fingerprints (int): Maximum number of the fingerprints to keep.
+        _on_repeat (Literal['stop', 'raise']): What to do when the output repeats.
+        _memo (OrderedDict[Hashable, Input] | None): Memo of the loopback.
 
     Example:
         >>> from runnable_family.loopback import RunnableLoopback
@@ -69,10 +237,18 @@ class RunnableLoopback(Runnable[Input, Output]):
         >>> print(result)  # Output: 7
         7
         >>> # 0 -(my_runnable)-> 1 -(my_loopback)-> 2 -(my_runnable)-> 3 -(my_loopback)-> 6 -(my_runnable)-> 7
-    """  # noqa
+        >>> list(loopback_runnable.stream_iterations(0))  # (iteration index, output)
+        [(0, 1), (1, 3), (2, 7)]
+        >>> list(loopback_runnable.stream(0))
+        [7]
 
-    _graph: CompiledStateGraph
-    '''Compiled graph of the runnable.'''
+    Note:
+        `stream_iterations` and `astream_iterations` yield the pairs of the
+        iteration index and the output of `runnable` in each iteration as
+        soon as it is produced, and stop the loop when the consumer stops
+        iterating. `stream`, `astream` and the downstream runnables composed
+        with the loopback, e.g. in a chain, receive only the final output.
+    """  # noqa
 
     _runnable: Runnable[Input, Output]
     '''Runnable to be looped back.'''
@@ -80,13 +256,59 @@ class RunnableLoopback(Runnable[Input, Output]):
     '''Condition to looping back.'''
     _loopback: Runnable[Output, Input]
     '''Runnable to loop back the output to the input.'''
+    _engine: Literal['graph', 'native']
+    '''Engine to run the loop.'''
+    _checkpointer: BaseCheckpointSaver | None
+    '''Checkpointer to save the state of the graph after each step.'''
+    _batch_mode: Literal['independent', 'lockstep']
+    '''Mode to run `batch` and `abatch`.'''
+    _fingerprint: Callable[[Output], Hashable] | None
+    '''Function to return the fingerprint of the output.'''
+    _max_fingerprints: int
+    '''Maximum number of the fingerprints to keep.'''
+    _on_repeat: Literal['stop', 'raise']
+    '''What to do when the output repeats.'''
+    _memo: OrderedDict[Hashable, Input] | None
+    '''Memo of the outputs of the loopback keyed by the fingerprints.'''
 
     def __init__(
         self,
         runnable: Runnable[Input, Output],
         condition: Runnable[Output, bool] | Callable[[Output], bool],
         loopback: Runnable[Output, Input],
+        engine: Literal['graph', 'native'] = 'graph',
+        checkpointer: BaseCheckpointSaver | None = None,
+        batch_mode: Literal['independent', 'lockstep'] = 'independent',
+        fingerprint: Callable[[Output], Hashable] | None = None,
+        max_fingerprints: int = 1024,
+        on_repeat: Literal['stop', 'raise'] = 'stop',
+        memoize_loopback: bool = False,
     ):
+        if engine not in ('graph', 'native'):
+            raise ValueError(f"engine must be 'graph' or 'native': engine={engine}")  # noqa
+        if checkpointer is not None and engine != 'graph':
+            raise ValueError("checkpointer is supported only by engine='graph'")  # noqa
+        if batch_mode not in ('independent', 'lockstep'):
+            raise ValueError(f"batch_mode must be 'independent' or 'lockstep': batch_mode={batch_mode}")  # noqa
+        if checkpointer is not None and batch_mode == 'lockstep':
+            raise ValueError("checkpointer is not supported by batch_mode='lockstep'")  # noqa
+        if fingerprint is not None and (engine != 'native' or batch_mode != 'independent'):  # noqa
+            raise ValueError("fingerprint is supported only by engine='native' and batch_mode='independent'")  # noqa
+        if max_fingerprints < 1:
+            raise ValueError(f'max_fingerprints must be positive: max_fingerprints={max_fingerprints}')  # noqa
+        if on_repeat not in ('stop', 'raise'):
+            raise ValueError(f"on_repeat must be 'stop' or 'raise': on_repeat={on_repeat}")  # noqa
+        if memoize_loopback and fingerprint is None:
+            raise ValueError('memoize_loopback requires fingerprint')
+        self._batch_mode = batch_mode
+        self._fingerprint = fingerprint
+        self._max_fingerprints = max_fingerprints
+        self._on_repeat = on_repeat
+        self._memo = OrderedDict() if memoize_loopback else None
+        self._memo_lock = threading.Lock()
+        self._engine = engine
+        self._checkpointer = checkpointer
+
         # components
         self._runnable = runnable
         if not isinstance(condition, Runnable):
@@ -95,53 +317,472 @@ class RunnableLoopback(Runnable[Input, Output]):
             self._condition = condition
         self._loopback = loopback
 
-        # define internal state schema
-        class _InternalStateSchema(TypedDict):
-            input: Input
-            output: Output
+    @cached_property
+    def _graph(self) -> CompiledStateGraph:
+        '''Compiled graph of the loop, which is compiled on the first use.
+        The graph reads the components from the config, so that the
+        loopbacks without a checkpointer share the same compiled graph.
+        '''
+        if self._checkpointer is None:
+            return _graph_template()
+        return _build_graph().compile(checkpointer=self._checkpointer)
 
-        # create graph
-        graph = StateGraph(_InternalStateSchema)
-        graph.add_node(
-            'runnable',
-            (
-                RunnableLambda(itemgetter('input'))
-                | RunnableParallel(
-                    input=RunnablePassthrough(),
-                    output=runnable,
-                )
-            ),
+    def _graph_config(self, config: RunnableConfig | None) -> RunnableConfig:
+        config = ensure_config(config)
+        return patch_config(
+            config,
+            configurable={
+                **config.get('configurable', {}),
+                _COMPONENTS_KEY: self,
+            },
         )
-        graph.add_node(
-            'loopback',
-            (
-                RunnableLambda(itemgetter('output'))
-                | RunnableParallel(
-                    output=RunnablePassthrough(),
-                    input=loopback,
+
+    def invoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Output:
+        if self._engine == 'native':
+            return self._call_with_config(
+                self._invoke_native,
+                input,
+                config,
+                **kwargs,
+            )
+        input_ = self._graph_input(input, config)
+        output_ = self._graph.invoke(input_, self._graph_config(config), **kwargs)  # type: ignore # noqa
+        return cast(Output, output_["output"])
+
+    def _graph_input(
+        self,
+        input: Input,
+        config: RunnableConfig | None,
+    ) -> dict[str, Input] | None:
+        '''Returns the input of the graph, which is None to resume the last
+        run on the thread if it has not been completed.
+        '''
+        if (
+            self._checkpointer is not None
+            and self._graph.get_state(ensure_config(config)).next
+        ):
+            return None
+        return dict(input=input)
+
+    async def _agraph_input(
+        self,
+        input: Input,
+        config: RunnableConfig | None,
+    ) -> dict[str, Input] | None:
+        if (
+            self._checkpointer is not None
+            and (await self._graph.aget_state(ensure_config(config))).next
+        ):
+            return None
+        return dict(input=input)
+
+    def _invoke_native(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        for _, output in self._iter_native(input, run_manager, config, **kwargs):  # noqa
+            pass
+        return output
+
+    def _iter_native(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Iterator[tuple[int, Output]]:
+        seen: OrderedDict[Hashable, None] = OrderedDict()
+        i = 0
+        while True:
+            config_ = patch_config(
+                config,
+                callbacks=run_manager.get_child(f'iteration:{i}'),
+            )
+            output = self._runnable.invoke(input, config_, **kwargs)
+            yield i, output
+            if not self._condition.invoke(output, config_):
+                return
+            if self._fingerprint is None:
+                input = self._loopback.invoke(output, config_)
+            else:
+                key = self._fingerprint(output)
+                if self._is_repeated(key, seen, i):
+                    return
+                input = self._recall(key)
+                if input is _MISSING:
+                    input = self._loopback.invoke(output, config_)
+                    self._memorize(key, input)
+            i += 1
+
+    def _is_repeated(
+        self,
+        key: Hashable,
+        seen: OrderedDict[Hashable, None],
+        i: int,
+    ) -> bool:
+        '''Returns whether the fingerprint has been seen in the run, or
+        raises `LoopbackCycleError` if `on_repeat` is 'raise'.
+        '''
+        if key in seen:
+            if self._on_repeat == 'raise':
+                raise LoopbackCycleError(
+                    f'the output of the iteration {i} repeats: {key!r}'
                 )
+            return True
+        seen[key] = None
+        if len(seen) > self._max_fingerprints:
+            seen.popitem(last=False)
+        return False
+
+    def _recall(self, key: Hashable) -> Any:
+        '''Returns the memorized output of the loopback or `_MISSING`.'''
+        if self._memo is None:
+            return _MISSING
+        with self._memo_lock:
+            if key not in self._memo:
+                return _MISSING
+            self._memo.move_to_end(key)
+            return self._memo[key]
+
+    def _memorize(self, key: Hashable, input: Input) -> None:
+        if self._memo is None:
+            return
+        with self._memo_lock:
+            self._memo[key] = input
+            if len(self._memo) > self._max_fingerprints:
+                self._memo.popitem(last=False)
+
+    def _iter_graph(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Iterator[tuple[int, Output]]:
+        updates = self._graph.stream(
+            self._graph_input(input, config),
+            self._graph_config(
+                patch_config(config, callbacks=run_manager.get_child()),
             ),
+            stream_mode='updates',
+            **kwargs,
         )
-        graph.add_conditional_edges(
-            'runnable',
-            (
-                RunnableLambda(itemgetter('output'))
-                | condition
-                | RunnableLambda(lambda b: 'continue' if b else 'end')
+        i = 0
+        for update in updates:
+            if 'runnable' in update:
+                yield i, update['runnable']['output']
+                i += 1
+
+    async def ainvoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Output:
+        if self._engine == 'native':
+            return await self._acall_with_config(
+                self._ainvoke_native,
+                input,
+                config,
+                **kwargs,
+            )
+        input_ = await self._agraph_input(input, config)
+        output_ = await self._graph.ainvoke(input_, self._graph_config(config), **kwargs)  # type: ignore # noqa
+        return cast(Output, output_["output"])
+
+    async def _ainvoke_native(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        async for _, output in self._aiter_native(
+            input,
+            run_manager,
+            config,
+            **kwargs,
+        ):
+            pass
+        return output
+
+    async def _aiter_native(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> AsyncIterator[tuple[int, Output]]:
+        seen: OrderedDict[Hashable, None] = OrderedDict()
+        i = 0
+        while True:
+            config_ = patch_config(
+                config,
+                callbacks=run_manager.get_child(f'iteration:{i}'),
+            )
+            output = await self._runnable.ainvoke(input, config_, **kwargs)
+            yield i, output
+            if not await self._condition.ainvoke(output, config_):
+                return
+            if self._fingerprint is None:
+                input = await self._loopback.ainvoke(output, config_)
+            else:
+                key = self._fingerprint(output)
+                if self._is_repeated(key, seen, i):
+                    return
+                input = self._recall(key)
+                if input is _MISSING:
+                    input = await self._loopback.ainvoke(output, config_)
+                    self._memorize(key, input)
+            i += 1
+
+    async def _aiter_graph(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> AsyncIterator[tuple[int, Output]]:
+        updates = self._graph.astream(
+            await self._agraph_input(input, config),
+            self._graph_config(
+                patch_config(config, callbacks=run_manager.get_child()),
             ),
-            {
-                'continue': 'loopback',
-                'end': END,
-            },
+            stream_mode='updates',
+            **kwargs,
         )
-        graph.add_edge('loopback', 'runnable')
-        graph.set_entry_point('runnable')
-        self._graph = graph.compile()
+        i = 0
+        async for update in updates:
+            if 'runnable' in update:
+                yield i, update['runnable']['output']
+                i += 1
 
-    def invoke(self, input: Input, *args, **kwargs) -> Output:
-        input_ = dict(input=input)  # type: ignore
-        output_ = self._graph.invoke(input_, *args, **kwargs)  # type: ignore
-        return cast(Output, output_["output"])
+    def stream_iterations(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Iterator[tuple[int, Output]]:
+        '''Yields the pairs of the index and the output of each iteration
+        as soon as the iteration finishes.
+        '''
+        config = ensure_config(config)
+        callback_manager = get_callback_manager_for_config(config)
+        run_manager = callback_manager.on_chain_start(
+            None,
+            input,
+            name=config.get('run_name') or self.get_name(),
+            run_id=config.pop('run_id', None),
+        )
+        iter_outputs = (
+            self._iter_native
+            if self._engine == 'native'
+            else self._iter_graph
+        )
+        try:
+            for i, output in iter_outputs(input, run_manager, config, **kwargs):  # noqa
+                yield i, output
+        except BaseException as e:
+            run_manager.on_chain_error(e)
+            raise
+        else:
+            run_manager.on_chain_end(output)
+
+    async def astream_iterations(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[tuple[int, Output]]:
+        '''Yields the pairs of the index and the output of each iteration
+        as soon as the iteration finishes.
+        '''
+        config = ensure_config(config)
+        callback_manager = get_async_callback_manager_for_config(config)
+        run_manager = await callback_manager.on_chain_start(
+            None,
+            input,
+            name=config.get('run_name') or self.get_name(),
+            run_id=config.pop('run_id', None),
+        )
+        aiter_outputs = (
+            self._aiter_native
+            if self._engine == 'native'
+            else self._aiter_graph
+        )
+        try:
+            async for i, output in aiter_outputs(
+                input,
+                run_manager,
+                config,
+                **kwargs,
+            ):
+                yield i, output
+        except BaseException as e:
+            await run_manager.on_chain_error(e)
+            raise
+        else:
+            await run_manager.on_chain_end(output)
+
+    def batch(
+        self,
+        inputs: list[Input],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Output]:
+        if self._batch_mode != 'lockstep':
+            return super().batch(
+                inputs,
+                config,
+                return_exceptions=return_exceptions,
+                **kwargs,
+            )
+        return self._batch_with_config(
+            partial(self._batch_lockstep, return_exceptions=return_exceptions),  # noqa
+            inputs,
+            config,
+            return_exceptions=return_exceptions,
+            **kwargs,
+        )
+
+    def _batch_lockstep(
+        self,
+        inputs: list[Input],
+        run_manager: list[CallbackManagerForChainRun],
+        config: list[RunnableConfig],
+        return_exceptions: bool,
+        **kwargs: Any,
+    ) -> list[Output | Exception]:
+        results: list[Output | Exception] = [None] * len(inputs)  # type: ignore # noqa
+        # NOTE: the pairs of the index and the input of the active items
+        active: list[tuple[int, Input]] = list(enumerate(inputs))
+        i = 0
+        while active:
+            configs = {
+                j: patch_config(
+                    config[j],
+                    callbacks=run_manager[j].get_child(f'iteration:{i}'),
+                )
+                for j, _ in active
+            }
+            outputs = self._settle(results, active, self._runnable.batch(
+                [input for _, input in active],
+                [configs[j] for j, _ in active],
+                return_exceptions=return_exceptions,
+                **kwargs,
+            ))
+            conditions = self._settle(results, outputs, self._condition.batch(
+                [output for _, output in outputs],
+                [configs[j] for j, _ in outputs],
+                return_exceptions=return_exceptions,
+            ))
+            looping: list[tuple[int, Output]] = []
+            for (j, output), (_, condition) in zip(outputs, conditions):
+                if condition:
+                    looping.append((j, output))
+                else:
+                    results[j] = output
+            active = self._settle(results, looping, self._loopback.batch(
+                [output for _, output in looping],
+                [configs[j] for j, _ in looping],
+                return_exceptions=return_exceptions,
+            ))
+            i += 1
+        return results
+
+    async def abatch(
+        self,
+        inputs: list[Input],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Output]:
+        if self._batch_mode != 'lockstep':
+            return await super().abatch(
+                inputs,
+                config,
+                return_exceptions=return_exceptions,
+                **kwargs,
+            )
+        return await self._abatch_with_config(
+            partial(self._abatch_lockstep, return_exceptions=return_exceptions),  # noqa
+            inputs,
+            config,
+            return_exceptions=return_exceptions,
+            **kwargs,
+        )
+
+    async def _abatch_lockstep(
+        self,
+        inputs: list[Input],
+        run_manager: list[AsyncCallbackManagerForChainRun],
+        config: list[RunnableConfig],
+        return_exceptions: bool,
+        **kwargs: Any,
+    ) -> list[Output | Exception]:
+        results: list[Output | Exception] = [None] * len(inputs)  # type: ignore # noqa
+        active: list[tuple[int, Input]] = list(enumerate(inputs))
+        i = 0
+        while active:
+            configs = {
+                j: patch_config(
+                    config[j],
+                    callbacks=run_manager[j].get_child(f'iteration:{i}'),
+                )
+                for j, _ in active
+            }
+            outputs = self._settle(results, active, await self._runnable.abatch(  # noqa
+                [input for _, input in active],
+                [configs[j] for j, _ in active],
+                return_exceptions=return_exceptions,
+                **kwargs,
+            ))
+            conditions = self._settle(results, outputs, await self._condition.abatch(  # noqa
+                [output for _, output in outputs],
+                [configs[j] for j, _ in outputs],
+                return_exceptions=return_exceptions,
+            ))
+            looping: list[tuple[int, Output]] = []
+            for (j, output), (_, condition) in zip(outputs, conditions):
+                if condition:
+                    looping.append((j, output))
+                else:
+                    results[j] = output
+            active = self._settle(results, looping, await self._loopback.abatch(  # noqa
+                [output for _, output in looping],
+                [configs[j] for j, _ in looping],
+                return_exceptions=return_exceptions,
+            ))
+            i += 1
+        return results
+
+    @staticmethod
+    def _settle(
+        results: list[Any],
+        items: list[tuple[int, Any]],
+        values: list[Any],
+    ) -> list[tuple[int, Any]]:
+        '''Records the exceptions among the values of the items as their
+        results and returns the pairs of the index and the value of the rest.
+        '''
+        rest: list[tuple[int, Any]] = []
+        for (j, _), value in zip(items, values):
+            if isinstance(value, Exception):
+                results[j] = value
+            else:
+                rest.append((j, value))
+        return rest
 
     @classmethod
     def with_n_loop(
@@ -151,8 +792,12 @@ class RunnableLoopback(Runnable[Input, Output]):
         loopback: Runnable[Output, Input],
         output_key_header: str = "output",
         counter_key_header: str = "counter",
+        engine: Literal['graph', 'native'] = 'graph',
+        checkpointer: BaseCheckpointSaver | None = None,
+        batch_mode: Literal['independent', 'lockstep'] = 'independent',
     ) -> Runnable[Input, Output]:
         '''Returns a new RunnableLoopback with n loops.
+        See also `RunnableNLoop`, which runs the same loop with less overhead.
         '''
         if n == 0:
             return RunnablePassthrough()  # type: ignore
@@ -192,6 +837,9 @@ class RunnableLoopback(Runnable[Input, Output]):
             runnable=_runnable,  # type: ignore
             condition=_condition,  # type: ignore
             loopback=_loopback,  # type: ignore
+            engine=engine,  # type: ignore
+            checkpointer=checkpointer,  # type: ignore
+            batch_mode=batch_mode,  # type: ignore
         ) | RunnablePassthrough().pick(output_key)
 
     def get_graph(self, config: RunnableConfig | None = None) -> langchain_core.runnables.graph.Graph:  # noqa
@@ -232,3 +880,335 @@ class RunnableLoopback(Runnable[Input, Output]):
     @property
     def OutputType(self) -> type[Output]:
         return self._runnable.OutputType
+
+
+class RunnableNLoop(Runnable[Input, Output]):
+    """Runnable that runs a runnable n times, looping back the output to the
+    input between the runs.
+    This has the same semantics as `RunnableLoopback.with_n_loop`, i.e.
+    `runnable` is invoked n times and `loopback` n-1 times, and the input is
+    returned as it is if n is 0. The loop is run with a plain counter, so
+    the bookkeeping per iteration is O(1) without any graph or dict keys.
+
+    Args:
+        n (int): The number of the runs of `runnable`. Must be non-negative.
+        runnable (Runnable[Input, Output]): The runnable to be looped back.
+        loopback (Runnable[Output, Input]): A runnable that transforms the
+            output of `runnable` into the input of the next run.
+
+    Attributes:
+        _n (int): The number of the runs of `runnable`.
+        _runnable (Runnable[Input, Output]): The runnable to be looped back.
+        _loopback (Runnable[Output, Input]): Runnable to transform output back to input.
+
+    Example:
+        >>> from runnable_family.loopback import RunnableNLoop
+        >>> from langchain_core.runnables import RunnableLambda
+        >>> n_loop = RunnableNLoop(
+        ...     3,
+        ...     runnable=RunnableLambda(lambda x: x + 1),
+        ...     loopback=RunnableLambda(lambda x: x * 2),
+        ... )
+        >>> n_loop.invoke(0)
+        7
+        >>> # 0 -(runnable)-> 1 -(loopback)-> 2 -(runnable)-> 3 -(loopback)-> 6 -(runnable)-> 7
+        >>> RunnableNLoop.unrolled(
+        ...     3,
+        ...     runnable=RunnableLambda(lambda x: x + 1),
+        ...     loopback=RunnableLambda(lambda x: x * 2),
+        ... ).invoke(0)
+        7
+
+    Note:
+        The runnable, and the loopback after it, in the i-th iteration are
+        traced with the tag `iteration:i`.
+    """  # noqa
+
+    _n: int
+    '''Number of the runs of the runnable.'''
+    _runnable: Runnable[Input, Output]
+    '''Runnable to be looped back.'''
+    _loopback: Runnable[Output, Input]
+    '''Runnable to loop back the output to the input.'''
+
+    def __init__(
+        self,
+        n: int,
+        runnable: Runnable[Input, Output],
+        loopback: Runnable[Output, Input],
+    ):
+        if n < 0:
+            raise ValueError(f'n must be non-negative: n={n}')
+        self._n = n
+        self._runnable = runnable
+        self._loopback = loopback
+
+    @classmethod
+    def unrolled(
+        cls,
+        n: int,
+        runnable: Runnable[Input, Output],
+        loopback: Runnable[Output, Input],
+    ) -> Runnable[Input, Output]:
+        '''Returns the loop unrolled into a sequence of `runnable` and
+        `loopback`, which is cheaper than the loop for a small n.
+        '''
+        if n < 0:
+            raise ValueError(f'n must be non-negative: n={n}')
+        if n == 0:
+            return RunnablePassthrough()  # type: ignore
+        steps: list[Runnable] = [runnable]
+        for _ in range(n - 1):
+            steps.extend([loopback, runnable])
+        if len(steps) == 1:
+            return runnable
+        return RunnableSequence(*steps)
+
+    def invoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Output:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    def _invoke(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        output: Output = input  # type: ignore
+        for i in range(self._n):
+            config_ = patch_config(
+                config,
+                callbacks=run_manager.get_child(f'iteration:{i}'),
+            )
+            if i > 0:
+                input = self._loopback.invoke(output, config_)
+            output = self._runnable.invoke(input, config_, **kwargs)
+        return output
+
+    async def ainvoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Output:
+        return await self._acall_with_config(
+            self._ainvoke,
+            input,
+            config,
+            **kwargs,
+        )
+
+    async def _ainvoke(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        output: Output = input  # type: ignore
+        for i in range(self._n):
+            config_ = patch_config(
+                config,
+                callbacks=run_manager.get_child(f'iteration:{i}'),
+            )
+            if i > 0:
+                input = await self._loopback.ainvoke(output, config_)
+            output = await self._runnable.ainvoke(input, config_, **kwargs)
+        return output
+
+    @property
+    def InputType(self) -> type[Input]:
+        return self._runnable.InputType
+
+    @property
+    def OutputType(self) -> type[Output]:
+        return self._runnable.OutputType
+
+
+class RunnableBeamSearch(Runnable[Input, list[Output]]):
+    """Runnable that loops back the top-k outputs, i.e. beam search.
+    In each iteration, every candidate in the beam is expanded
+    `n_expansions` times by `runnable`, the expanded outputs are scored by
+    `scorer`, and the best `beam_width` outputs are looped back to the
+    inputs of the next iteration by `loopback`. All the expansions, scores
+    and loopbacks of one iteration are sent as one `batch` call each.
+
+    Args:
+        runnable (Runnable[Input, Output]): The runnable to expand each
+            candidate, which is expected to be stochastic when
+            `n_expansions` is more than 1.
+        scorer (Runnable[Output, float] | Callable[[Output], float]): The
+            runnable to score the outputs. The higher, the better.
+            If a callable is provided, it will be wrapped in a RunnableLambda.
+        loopback (Runnable[Output, Input]): A runnable that transforms the
+            kept outputs into the inputs of the next iteration.
+        beam_width (int): The number of the outputs kept in each iteration.
+        max_depth (int): The number of the iterations.
+        n_expansions (int | None): The number of the expansions of each
+            candidate. If None, `beam_width` is used. Default is None.
+
+    Attributes:
+        _runnable (Runnable[Input, Output]): The runnable to expand the candidates.
+        _scorer (Runnable[Output, float]): The runnable to score the outputs.
+        _loopback (Runnable[Output, Input]): Runnable to transform output back to input.
+        _beam_width (int): The number of the outputs kept in each iteration.
+        _max_depth (int): The number of the iterations.
+        _n_expansions (int): The number of the expansions of each candidate.
+
+    Example:
+        >>> from runnable_family.loopback import RunnableBeamSearch
+        >>> from langchain_core.runnables import RunnableLambda
+        >>> beam_search = RunnableBeamSearch(
+        ...     runnable=RunnableLambda(lambda x: x + 1),
+        ...     scorer=lambda output: output,
+        ...     loopback=RunnableLambda(lambda output: output * 2),
+        ...     beam_width=2,
+        ...     max_depth=3,
+        ... )
+        >>> beam_search.invoke(0)  # the outputs in the last beam
+        [7, 7]
+        >>> # 0 -(runnable)-> 1 -(loopback)-> 2 -(runnable)-> 3 -(loopback)-> 6 -(runnable)-> 7
+
+    Note:
+        The output is the list of the outputs in the last beam sorted by
+        their scores in descending order. The scores are compared only
+        among the outputs in the same iteration.
+        The calls in the d-th iteration are traced with the tag `depth:d`.
+    """  # noqa
+
+    _runnable: Runnable[Input, Output]
+    '''Runnable to expand the candidates.'''
+    _scorer: Runnable[Output, float]
+    '''Runnable to score the outputs.'''
+    _loopback: Runnable[Output, Input]
+    '''Runnable to loop back the output to the input.'''
+    _beam_width: int
+    '''Number of the outputs kept in each iteration.'''
+    _max_depth: int
+    '''Number of the iterations.'''
+    _n_expansions: int
+    '''Number of the expansions of each candidate.'''
+
+    def __init__(
+        self,
+        runnable: Runnable[Input, Output],
+        scorer: Runnable[Output, float] | Callable[[Output], float],
+        loopback: Runnable[Output, Input],
+        beam_width: int,
+        max_depth: int,
+        n_expansions: int | None = None,
+    ):
+        if beam_width < 1:
+            raise ValueError(f'beam_width must be positive: beam_width={beam_width}')  # noqa
+        if max_depth < 1:
+            raise ValueError(f'max_depth must be positive: max_depth={max_depth}')  # noqa
+        if n_expansions is not None and n_expansions < 1:
+            raise ValueError(f'n_expansions must be positive: n_expansions={n_expansions}')  # noqa
+        self._runnable = runnable
+        if not isinstance(scorer, Runnable):
+            self._scorer = RunnableLambda(scorer)
+        else:
+            self._scorer = scorer
+        self._loopback = loopback
+        self._beam_width = beam_width
+        self._max_depth = max_depth
+        self._n_expansions = n_expansions or beam_width
+
+    def invoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> list[Output]:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    def _invoke(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> list[Output]:
+        beam = [input]
+        kept: list[Output] = []
+        for depth in range(self._max_depth):
+            config_ = patch_config(
+                config,
+                callbacks=run_manager.get_child(f'depth:{depth}'),
+            )
+            outputs = self._runnable.batch(
+                [input for input in beam for _ in range(self._n_expansions)],
+                config_,
+                **kwargs,
+            )
+            scores = self._scorer.batch(outputs, config_)
+            kept = self._select(outputs, scores)
+            if depth < self._max_depth - 1:
+                beam = self._loopback.batch(kept, config_)
+        return kept
+
+    async def ainvoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> list[Output]:
+        return await self._acall_with_config(
+            self._ainvoke,
+            input,
+            config,
+            **kwargs,
+        )
+
+    async def _ainvoke(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> list[Output]:
+        beam = [input]
+        kept: list[Output] = []
+        for depth in range(self._max_depth):
+            config_ = patch_config(
+                config,
+                callbacks=run_manager.get_child(f'depth:{depth}'),
+            )
+            outputs = await self._runnable.abatch(
+                [input for input in beam for _ in range(self._n_expansions)],
+                config_,
+                **kwargs,
+            )
+            scores = await self._scorer.abatch(outputs, config_)
+            kept = self._select(outputs, scores)
+            if depth < self._max_depth - 1:
+                beam = await self._loopback.abatch(kept, config_)
+        return kept
+
+    def _select(
+        self,
+        outputs: list[Output],
+        scores: list[float],
+    ) -> list[Output]:
+        '''Returns the best `beam_width` outputs in descending order of
+        the scores. The ties are kept in the order of the outputs.
+        '''
+        best = heapq.nlargest(
+            self._beam_width,
+            range(len(outputs)),
+            key=scores.__getitem__,
+        )
+        return [outputs[i] for i in best]
+
+    @property
+    def InputType(self) -> type[Input]:
+        return self._runnable.InputType
+
+    @property
+    def OutputType(self) -> type[list[Output]]:
+        return list[self._runnable.OutputType]  # type: ignore
@@ -1,21 +1,233 @@
+import asyncio
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+import contextvars
 from functools import partial
-from itertools import accumulate
+import hashlib
+from itertools import accumulate, chain, islice
+import math
 import operator
 import random
-from typing import Callable, Iterable
+import threading
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    Sequence,
+    cast,
+)
+from uuid import UUID
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForChainRun,
+    BaseCallbackHandler,
+    BaseCallbackManager,
+    CallbackManagerForChainRun,
+)
 from langchain_core.runnables import (
     Runnable,
-    RunnableBranch,
+    RunnableConfig,
     RunnableLambda,
-    RunnableMap,
-    RunnablePassthrough,
-    RunnablePick,
-    RunnableSequence,
 )
 from langchain_core.runnables.base import Input, Output
+from langchain_core.runnables.config import (
+    get_executor_for_config,
+    patch_config,
+)
+
+SEED_CONFIG_KEY: str = 'random_branch_seed'
+'''Key in `configurable` of the config to seed the random values per call.'''
+
+_MIN_HEDGE_SAMPLES: int = 10
+'''Number of the latencies required to learn the threshold of hedging.'''
+
+
+def derive_seed(config: RunnableConfig, salt: int | str) -> RunnableConfig:
+    '''Returns the config whose seed per call is replaced with the one
+    hashed from the seed and `salt`, or the config as is without a seed.
+
+    The runnables which consume the seed pass the derived one to the inner
+    runnables, so that the nested or repeated branches do not draw the same
+    values while the whole call is still reproducible by the seed.
+
+    Example:
+        >>> from runnable_family.random import SEED_CONFIG_KEY, derive_seed
+        >>> config = {'configurable': {SEED_CONFIG_KEY: 0}}
+        >>> derive_seed(config, 0) == derive_seed(config, 0)
+        True
+        >>> derive_seed(config, 0) == derive_seed(config, 1)
+        False
+    '''
+    configurable = config.get('configurable', {})
+    seed = configurable.get(SEED_CONFIG_KEY)
+    if seed is None:
+        return config
+    digest = hashlib.blake2b(
+        repr((seed, salt)).encode(),
+        digest_size=8,
+    ).digest()
+    return cast(RunnableConfig, {
+        **config,
+        'configurable': {
+            **configurable,
+            SEED_CONFIG_KEY: int.from_bytes(digest, 'little'),
+        },
+    })
+
+
+class BlockRandom:
+    """Thread-safe random generator which draws uniform random values in
+    [0, 1) in blocks to amortize the cost of the lock.
+    The sequence of the values is the same as that of `random.Random(seed)`
+    whatever the block size is, so the draws are reproducible by the seed.
+
+    Args:
+        seed: The seed of the generator. If None, it is seeded by the OS.
+        block_size: The number of the random values drawn at once.
+
+    Example:
+        >>> from runnable_family.random import BlockRandom
+        >>> generate_random_value = BlockRandom(seed=0, block_size=4)
+        >>> generate_random_value() == BlockRandom(seed=0).draw(1)[0]
+        True
+        >>> len(generate_random_value.draw(10))
+        10
+    """
+
+    def __init__(self, seed: int | None = None, block_size: int = 256):
+        if block_size < 1:
+            raise ValueError(f'block_size must be positive: block_size={block_size}')  # noqa
+        self._random = random.Random(seed)
+        self._block_size = block_size
+        # NOTE: the values are popped from the end
+        self._block: list[float] = []
+        self._lock = threading.Lock()
+
+    def __call__(self) -> float:
+        return self.draw(1)[0]
+
+    def draw(self, n: int) -> list[float]:
+        """Returns the next n random values."""
+        with self._lock:
+            while len(self._block) < n:
+                block = [
+                    self._random.random()
+                    for _ in range(max(self._block_size, n - len(self._block)))  # noqa
+                ]
+                block.reverse()
+                self._block = block + self._block
+            values = self._block[-n:] if n else []
+            del self._block[len(self._block) - n:]
+        values.reverse()
+        return values
+
+
+def _hash_unit(key: bytes, i: int) -> float:
+    '''Returns a uniform value in (0, 1) hashed from the key and the index,
+    which is stable across processes unlike `hash`.
+    '''
+    digest = hashlib.blake2b(
+        key,
+        digest_size=8,
+        salt=i.to_bytes(8, 'little'),
+    ).digest()
+    return ((int.from_bytes(digest, 'little') >> 11) + 0.5) / 2 ** 53
+
+
+async def _aprepend(first: Input, rest: AsyncIterator[Input]) -> AsyncIterator[Input]:  # noqa
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+class _BranchStats:
+    '''Exponential moving averages of the latency and the error rate.'''
+
+    def __init__(self) -> None:
+        self.latency: float | None = None
+        self.error_rate: float = 0.0
+
+    def update(self, latency: float, error_rate: float, smoothing: float) -> None:  # noqa
+        if self.latency is None:
+            self.latency, self.error_rate = latency, error_rate
+            return
+        self.latency += smoothing * (latency - self.latency)
+        self.error_rate += smoothing * (error_rate - self.error_rate)
+
+    def score(self) -> float | None:
+        '''Returns the throughput without errors or None if not measured.'''
+        if self.latency is None:
+            return None
+        return (1 - self.error_rate) / max(self.latency, 1e-9)
+
+
+class _LatencyRecorder(BaseCallbackHandler):
+    '''Callback handler which records the latency and the error of each run
+    started with it, i.e. of each input of a batch.
+    '''
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        self.samples: list[tuple[float, float]] = []
+        self._starts: dict[UUID, float] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, callbacks: BaseCallbackManager) -> BaseCallbackManager:
+        '''Returns a copy of the callbacks with this handler, which is not
+        inherited by the nested runs.
+        '''
+        callbacks = callbacks.copy()
+        callbacks.add_handler(self, inherit=False)
+        return callbacks
+
+    def _start(self, run_id: UUID) -> None:
+        with self._lock:
+            self._starts[run_id] = time.perf_counter()
 
+    def _end(self, run_id: UUID, error_rate: float) -> None:
+        with self._lock:
+            start = self._starts.pop(run_id, None)
+            if start is not None:
+                self.samples.append((time.perf_counter() - start, error_rate))  # noqa
 
-class RunnableRandomBranch(RunnableSequence[Input, Output]):
+    def on_chain_start(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._start(run_id)
+
+    def on_llm_start(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._start(run_id)
+
+    def on_chat_model_start(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._start(run_id)
+
+    def on_retriever_start(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._start(run_id)
+
+    def on_chain_end(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._end(run_id, 0.0)
+
+    def on_llm_end(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._end(run_id, 0.0)
+
+    def on_retriever_end(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._end(run_id, 0.0)
+
+    def on_chain_error(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._end(run_id, 1.0)
+
+    def on_llm_error(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._end(run_id, 1.0)
+
+    def on_retriever_error(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:  # noqa
+        self._end(run_id, 1.0)
+
+
+class RunnableRandomBranch(Runnable[Input, Output]):
     """Runnable that branches to one of the runnables based on given probabilities.
     This runnable randomly selects one of the provided runnables based on the specified probabilities.
     It is useful for scenarios where you want to randomly choose a runnable to execute,
@@ -27,11 +239,73 @@ class RunnableRandomBranch(RunnableSequence[Input, Output]):
         probs: An iterable of probabilities corresponding to each runnable.
             If not provided, equal probabilities are assigned to each runnable.
         generate_random_value: A callable that generates a random value between 0 and 1.
-            Defaults to `random.random`.
+            Defaults to a `BlockRandom` of this instance seeded by `seed`.
+        seed: The seed of the default random generator of this instance.
+            If None, the generator is seeded by the OS. This cannot be used
+            with `generate_random_value`. The seed can also be given per call
+            by `{'configurable': {'random_branch_seed': seed}}` in the config,
+            which overrides the generator of the instance for the call.
+            In `batch`, the seed of the first config is used to draw the
+            random values of all the inputs in order. The seed is consumed
+            by this instance, and the selected runnable receives a seed
+            derived from it by `derive_seed`.
+        block_size: The number of the random values which the default
+            generator draws at once. Default is 256.
+        routing: 'static' selects the runnables with `probs`. 'adaptive'
+            measures the latency and the errors of each runnable online and
+            weights `probs` by `(1 - error rate) / latency` of the runnables,
+            so that the traffic shifts toward the fast and healthy ones.
+            'sticky' selects the runnable by the weighted rendezvous hashing
+            of `key(input)` over `probs`, so that the identical keys always
+            hit the same runnable, e.g. to keep its caches warm, while the
+            keys are distributed by `probs` in aggregate. Changing a
+            probability moves only the keys from or to that runnable.
+            Default is 'static'.
+        key: Function which returns the key of the input for the sticky
+            routing. In `stream` and `transform`, the key is derived from
+            the first chunk of the input. Required iff `routing='sticky'`.
+        exploration: The share of the traffic routed by `probs` in the
+            adaptive routing, i.e. each runnable is selected at least with
+            `exploration` times its probability, which keeps measuring the
+            slow ones to detect their recovery. Default is 0.1.
+        smoothing: The smoothing factor of the exponential moving averages
+            of the latency and the error rate in the adaptive routing.
+            The larger, the faster the probabilities follow the changes.
+            Default is 0.2.
+        hedge_after: The seconds to wait for the selected runnable in
+            `invoke` and `ainvoke` before starting another runnable selected
+            with the remaining probabilities. The first successful output
+            wins and the other run is cancelled. 'auto' learns the threshold
+            as the `hedge_percentile` of the recent latencies. None disables
+            the hedging. Default is None.
+            NOTE: In `invoke`, each run starts in its own thread so that
+            the runs never wait for a worker under load, and the loser
+            cannot be interrupted in its thread, so it runs to the end in
+            the background and its output is discarded. `close` stops the
+            hedging and waits for such runs. In `ainvoke`, the loser is
+            cancelled. The selected runnable runs inline if no other
+            runnable can be selected or the threshold is not learned yet.
+        hedge_percentile: The percentile of the latencies used as the
+            threshold when `hedge_after='auto'`. Default is 0.95.
+        hedge_window: The number of the recent latencies used to learn the
+            threshold when `hedge_after='auto'`. Default is 100.
 
     Attributes:
-        _runnables (Iterable[Runnable[Input, Output]]): List of runnables to be branched.
-        _cum_probs (list[float]): Cumulative probabilities of the runnables.
+        _runnables (list[Runnable[Input, Output]]): List of runnables to be branched.
+        _cum_probs (list[float]): Cumulative probabilities of the runnables,
+            which are updated in the adaptive routing.
+        _probs (list[float]): Configured probabilities of the runnables.
+        _routing (Literal['static', 'adaptive', 'sticky']): Routing mode.
+        _key (Callable[[Input], str | bytes] | None): Key for sticky routing.
+        _exploration (float): Share of the traffic routed by `_probs`.
+        _smoothing (float): Smoothing factor of the moving averages.
+        _stats (list[_BranchStats]): Latency and error rate of the runnables.
+        _hedge_after (float | Literal['auto'] | None): Threshold of hedging.
+        _hedge_percentile (float): Percentile of the learned threshold.
+        _latencies (deque[float]): Recent latencies to learn the threshold.
+        _hedge_threads (set[threading.Thread]): Running threads of the
+            hedged calls of `invoke`.
+        _closed (bool): Whether the hedging is stopped by `close`.
         _generate_random_value (Callable[[], float]): Function to generate a random number.
         _allowed_numerical_error: float = 1e-8
 
@@ -62,7 +336,7 @@ class RunnableRandomBranch(RunnableSequence[Input, Output]):
         B: yet another input
     """  # noqa
 
-    _runnables: Iterable[Runnable[Input, Output]]
+    _runnables: list[Runnable[Input, Output]]
     """List of runnables to be branched."""
 
     _cum_probs: list[float]
@@ -73,16 +347,68 @@ class RunnableRandomBranch(RunnableSequence[Input, Output]):
 
     __allowed_numerical_error: float = 1e-8
 
+    _probs: list[float]
+    """Configured probabilities of the runnables."""
+
+    _routing: Literal['static', 'adaptive', 'sticky']
+    """Routing mode."""
+
+    _key: Callable[[Input], str | bytes] | None
+    """Function which returns the key of the input for the sticky routing."""
+
+    _exploration: float
+    """Share of the traffic routed by the configured probabilities."""
+
+    _smoothing: float
+    """Smoothing factor of the moving averages."""
+
+    _stats: list['_BranchStats']
+    """Latency and error rate of the runnables."""
+
+    _hedge_after: float | Literal['auto'] | None
+    """Threshold of hedging in seconds."""
+
+    _hedge_percentile: float
+    """Percentile of the latencies used as the learned threshold."""
+
     def __init__(
         self,
         *runnables: Runnable[Input, Output] | Callable[[Input], Output],
         probs: Iterable[float] | None = None,
-        generate_random_value: Callable[[], float] = random.random,
+        generate_random_value: Callable[[], float] | None = None,
         allowed_numerical_error: float = 1e-8,
+        seed: int | None = None,
+        block_size: int = 256,
+        routing: Literal['static', 'adaptive', 'sticky'] = 'static',
+        key: Callable[[Input], str | bytes] | None = None,
+        exploration: float = 0.1,
+        smoothing: float = 0.2,
+        hedge_after: float | Literal['auto'] | None = None,
+        hedge_percentile: float = 0.95,
+        hedge_window: int = 100,
     ):
+        if routing not in ('static', 'adaptive', 'sticky'):
+            raise ValueError(f"routing must be 'static', 'adaptive' or 'sticky': routing={routing}")  # noqa
+        if (routing == 'sticky') != (key is not None):
+            raise ValueError(f"key must be given iff routing='sticky': routing={routing}")  # noqa
+        if not 0 <= exploration <= 1:
+            raise ValueError(f'exploration must be in [0, 1]: exploration={exploration}')  # noqa
+        if not 0 < smoothing <= 1:
+            raise ValueError(f'smoothing must be in (0, 1]: smoothing={smoothing}')  # noqa
+        if hedge_after != 'auto' and hedge_after is not None and hedge_after < 0:  # noqa
+            raise ValueError(f"hedge_after must be non-negative, 'auto' or None: hedge_after={hedge_after}")  # noqa
+        if not 0 < hedge_percentile < 1:
+            raise ValueError(f'hedge_percentile must be in (0, 1): hedge_percentile={hedge_percentile}')  # noqa
+        if hedge_window < _MIN_HEDGE_SAMPLES:
+            raise ValueError(f'hedge_window must be >= {_MIN_HEDGE_SAMPLES}: hedge_window={hedge_window}')  # noqa
+
         # defaults
         if probs is None:
             probs = [1./len(runnables)] * len(runnables)
+        if generate_random_value is None:
+            generate_random_value = BlockRandom(seed, block_size=block_size)
+        elif seed is not None:
+            raise ValueError('seed cannot be used with generate_random_value')
 
         # validation
         # check non-negative probabilities
@@ -107,35 +433,655 @@ class RunnableRandomBranch(RunnableSequence[Input, Output]):
         self._cum_probs = list(accumulate(probs, func=operator.add))
         self._generate_random_value = generate_random_value
         self.__allowed_numerical_error = allowed_numerical_error
+        self._probs = probs
+        self._routing = routing
+        self._key = key
+        self._exploration = exploration
+        self._smoothing = smoothing
+        self._stats = [_BranchStats() for _ in self._runnables]
+        self._stats_lock = threading.Lock()
+        self._hedge_after = hedge_after
+        self._hedge_percentile = hedge_percentile
+        self._latencies: deque[float] = deque(maxlen=hedge_window)
+        self._hedge_counts = {'requests': 0, 'hedged': 0, 'hedge_won': 0}
+        self._hedge_lock = threading.Lock()
+        self._hedge_threads: set[threading.Thread] = set()
+        self._closed = False
+
+    def _select(self, random_value: float) -> int:
+        """Returns the index of the runnable selected by the random value,
+        i.e. the first index whose cumulative probability is not less than
+        the random value.
+        """
+        if not 0 <= random_value <= 1:
+            raise ValueError(f'The random number x is out of range [0, 1]: x={random_value}')  # noqa
+        # NOTE: the random value can exceed the last cumulative probability
+        #       by a numerical error
+        return min(
+            bisect_left(self._cum_probs, random_value),
+            len(self._runnables) - 1,
+        )
+
+    @property
+    def probs(self) -> list[float]:
+        '''Current probabilities to select the runnables.'''
+        return [
+            b - a for a, b in zip([0.0] + self._cum_probs, self._cum_probs)
+        ]
+
+    @contextmanager
+    def _measure(self, i: int) -> Iterator[None]:
+        '''Measures the latency and the error of the i-th runnable in the
+        block and updates the probabilities in the adaptive routing.
+        '''
+        if self._routing != 'adaptive':
+            yield
+            return
+        start = time.perf_counter()
+        # NOTE: the runs abandoned by the consumers, e.g. streams closed
+        #       with GeneratorExit, are not recorded.
+        try:
+            yield
+        except Exception:
+            self._record(i, [(time.perf_counter() - start, 1.0)])
+            raise
+        self._record(i, [(time.perf_counter() - start, 0.0)])
+
+    @contextmanager
+    def _measure_batch(
+        self,
+        i: int,
+        configs: list[RunnableConfig],
+    ) -> Iterator[list[RunnableConfig]]:
+        '''Measures the latency and the error of each input of the batch of
+        the i-th runnable in the block, and updates the probabilities in the
+        adaptive routing. The configs of the inputs to measure are given.
+        '''
+        if self._routing != 'adaptive':
+            yield configs
+            return
+        # NOTE: the latencies are measured per input with the callbacks
+        #       so that they depend neither on the size of the group nor on
+        #       whether the runnable runs the batch concurrently.
+        recorder = _LatencyRecorder()
+        configs = [
+            patch_config(
+                config,
+                callbacks=recorder.attach(cast(BaseCallbackManager, config['callbacks'])),  # noqa
+            )
+            for config in configs
+        ]
+        start = time.perf_counter()
+        error_rate = 0.0
+        try:
+            yield configs
+        except Exception:
+            error_rate = 1.0
+            raise
+        finally:
+            samples = recorder.samples
+            if not samples and configs:
+                # NOTE: the runnable does not notify the callbacks, so the
+                #       mean latency of the inputs is recorded instead.
+                latency = (time.perf_counter() - start) / len(configs)
+                samples = [(latency, error_rate)] * len(configs)
+            self._record(i, samples)
+
+    def _record(self, i: int, samples: list[tuple[float, float]]) -> None:
+        '''Records the pairs of the latency and the error rate.'''
+        with self._stats_lock:
+            for latency, error_rate in samples:
+                self._stats[i].update(latency, error_rate, self._smoothing)
+            self._cum_probs = list(accumulate(self._adaptive_probs()))
+
+    def _adaptive_probs(self) -> list[float]:
+        '''Returns the probabilities weighted by the throughputs without
+        errors, i.e. `(1 - error rate) / latency`, of the runnables, which
+        are mixed with the configured probabilities by `exploration`.
+        '''
+        scores = [stats.score() for stats in self._stats]
+        known = [score for score in scores if score is not None]
+        # NOTE: the runnables not measured yet are optimistically scored
+        default = max(known, default=0.0) or 1.0
+        weights = [
+            prob * (default if score is None else score)
+            for prob, score in zip(self._probs, scores)
+        ]
+        total = sum(weights)
+        if total <= 0:
+            return list(self._probs)
+        return [
+            (1 - self._exploration) * weight / total + self._exploration * prob  # noqa
+            for weight, prob in zip(weights, self._probs)
+        ]
+
+    @property
+    def hedge_metrics(self) -> dict[str, int]:
+        '''Counts of the hedging in `invoke` and `ainvoke`:
+        'requests' is the number of the calls, 'hedged' is the number of the
+        calls which started another runnable, and 'hedge_won' is the number
+        of the calls answered by the other runnable.
+        '''
+        with self._hedge_lock:
+            return dict(self._hedge_counts)
 
-        super().__init__(
-            RunnableMap(
-                x=RunnablePassthrough(),
-                rv=RunnableLambda(lambda _: generate_random_value()),
-            ),
-            RunnableBranch(
-                *[
-                    (
-                        RunnablePick("rv")
-                        | RunnableLambda(partial(self._a_is_ge_0_le_b, b=thresh)),  # noqa
-                        RunnablePick("x") | runnable,
-                    )
-                    for runnable, thresh in zip(self._runnables, self._cum_probs)  # noqa
-                ],
-                (
-                    RunnablePick("rv")
-                    | RunnableLambda(
-                        lambda x: f'The random number x is out of range [0, 1]: {x=}'  # noqa
-                    )
-                    | RunnableLambda(self._raise_value_error)
+    def _count_hedge(self, key: str) -> None:
+        with self._hedge_lock:
+            self._hedge_counts[key] += 1
+
+    def _hedge_threshold(self) -> float | None:
+        '''Returns the seconds to wait before hedging or None not to hedge.'''
+        if self._closed:
+            return None
+        if self._hedge_after != 'auto':
+            return self._hedge_after
+        with self._hedge_lock:
+            if len(self._latencies) < _MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[int(self._hedge_percentile * (len(latencies) - 1))]
+
+    def _can_hedge(self, i: int) -> bool:
+        '''Returns whether a runnable other than the i-th one can be
+        selected.
+        '''
+        return any(prob > 0 for j, prob in enumerate(self.probs) if j != i)
+
+    def _select_hedge(self, i: int, config: RunnableConfig) -> int:
+        '''Selects a runnable other than the i-th one with the remaining
+        probabilities, which requires `_can_hedge(i)`.
+        '''
+        candidates = [
+            (j, prob) for j, prob in enumerate(self.probs)
+            if j != i and prob > 0
+        ]
+        cum_probs = list(accumulate(prob for _, prob in candidates))
+        # NOTE: the seed per call reproduces the value of the selected one
+        #       as the first value, so the second one is used.
+        seeded = config.get('configurable', {}).get(SEED_CONFIG_KEY) is not None  # noqa
+        random_value = self._draw(config, 2 if seeded else 1)[-1]
+        k = bisect_left(cum_probs, random_value * cum_probs[-1])
+        return candidates[min(k, len(candidates) - 1)][0]
+
+    def _invoke_branch(
+        self,
+        i: int,
+        input: Input,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        start = time.perf_counter()
+        with self._measure(i):
+            output = self._runnables[i].invoke(input, config, **kwargs)
+        with self._hedge_lock:
+            self._latencies.append(time.perf_counter() - start)
+        return output
+
+    async def _ainvoke_branch(
+        self,
+        i: int,
+        input: Input,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        start = time.perf_counter()
+        with self._measure(i):
+            output = await self._runnables[i].ainvoke(input, config, **kwargs)
+        with self._hedge_lock:
+            self._latencies.append(time.perf_counter() - start)
+        return output
+
+    def _draw(self, config: RunnableConfig, n: int) -> list[float]:
+        '''Returns n random values, which are drawn from a generator seeded
+        by the seed in the config if any.
+        '''
+        seed = config.get('configurable', {}).get(SEED_CONFIG_KEY)
+        if seed is not None:
+            return BlockRandom(seed, block_size=n).draw(n)
+        if isinstance(self._generate_random_value, BlockRandom):
+            return self._generate_random_value.draw(n)
+        return [self._generate_random_value() for _ in range(n)]
+
+    def _select_sticky(self, input: Input) -> int:
+        '''Selects the runnable with the highest weighted rendezvous score
+        `-prob / log(hash(key, i))`, which is the i-th one with `prob`.
+        '''
+        assert self._key is not None
+        key = self._key(input)
+        key_bytes = key if isinstance(key, bytes) else key.encode()
+        return max(
+            (i for i, prob in enumerate(self._probs) if prob > 0),
+            key=lambda i: -self._probs[i] / math.log(_hash_unit(key_bytes, i)),  # noqa
+        )
+
+    def _select_config(
+        self,
+        run_manager: CallbackManagerForChainRun | AsyncCallbackManagerForChainRun,  # noqa
+        config: RunnableConfig,
+        input: Any,
+    ) -> tuple[int, RunnableConfig]:
+        '''Selects a runnable, where `input` is used only in the sticky
+        routing, and returns its index and the config for it.
+        '''
+        if self._routing == 'sticky':
+            i = self._select_sticky(input)
+        else:
+            i = self._select(self._draw(config, 1)[0])
+        return i, patch_config(
+            derive_seed(config, 0),
+            callbacks=run_manager.get_child(f'branch:{i}'),
+        )
+
+    def invoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Output:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    def _invoke(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        if self._hedge_after is not None:
+            return self._invoke_hedged(input, run_manager, config, **kwargs)
+        i, config = self._select_config(run_manager, config, input)
+        with self._measure(i):
+            return self._runnables[i].invoke(input, config, **kwargs)
+
+    def _invoke_hedged(
+        self,
+        input: Input,
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        self._count_hedge('requests')
+        threshold = self._hedge_threshold()
+        i, config_i = self._select_config(run_manager, config, input)
+        if threshold is None or not self._can_hedge(i):
+            return self._invoke_branch(i, input, config_i, **kwargs)
+        # NOTE: the selected one runs in its own thread, not inline,
+        #       so that the output of the hedge can be returned before the
+        #       selected one finishes.
+        futures: dict[Future[Output], int] = {
+            self._start_run(i, input, config_i, **kwargs): i,
+        }
+        done, pending = wait(futures, timeout=threshold)
+        if not done:
+            j = self._select_hedge(i, config)
+            self._count_hedge('hedged')
+            config_j = patch_config(
+                derive_seed(config, 0),
+                callbacks=run_manager.get_child(f'hedge:{j}'),
+            )
+            futures[self._start_run(j, input, config_j, **kwargs)] = j
+            pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if futures[future] != i:
+                        self._count_hedge('hedge_won')
+                    # NOTE: the loser cannot be interrupted in its thread
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+        # NOTE: all the runs failed, so the error of the selected one
+        #       is raised
+        primary = next(iter(futures))
+        return primary.result()
+
+    def _start_run(
+        self,
+        i: int,
+        input: Input,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Future[Output]:
+        '''Starts the i-th runnable in a new daemon thread with a copy of
+        the current context and returns the future of its output.
+        '''
+        future: Future[Output] = Future()
+        context = contextvars.copy_context()
+
+        def run() -> None:
+            output: Any = None
+            error: BaseException | None = None
+            running = future.set_running_or_notify_cancel()
+            if running:
+                try:
+                    output = context.run(self._invoke_branch, i, input, config, **kwargs)  # noqa
+                except BaseException as e:
+                    error = e
+            # NOTE: the thread leaves before the output is delivered, so that
+            #       the threads are only the ones whose runs are not done
+            with self._hedge_lock:
+                self._hedge_threads.discard(thread)
+            if not running:
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(output)
+
+        thread = threading.Thread(
+            target=run,
+            name=f'RunnableRandomBranch-{i}',
+            daemon=True,
+        )
+        with self._hedge_lock:
+            self._hedge_threads.add(thread)
+        thread.start()
+        return future
+
+    def close(self, timeout: float | None = None) -> None:
+        '''Stops the hedging and waits for the runs of the hedged calls of
+        `invoke` in the background, e.g. the losers, to finish.
+        This instance can still be called without hedging after this.
+
+        Args:
+            timeout: The maximum seconds to wait for the runs in total.
+                If None, waits until all the runs finish. Default is None.
+        '''
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._hedge_lock:
+            threads = list(self._hedge_threads)
+        for thread in threads:
+            thread.join(
+                None if deadline is None
+                else max(deadline - time.monotonic(), 0.0)
+            )
+
+    async def ainvoke(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Output:
+        return await self._acall_with_config(
+            self._ainvoke,
+            input,
+            config,
+            **kwargs,
+        )
+
+    async def _ainvoke(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        if self._hedge_after is not None:
+            return await self._ainvoke_hedged(input, run_manager, config, **kwargs)  # noqa
+        i, config = self._select_config(run_manager, config, input)
+        with self._measure(i):
+            return await self._runnables[i].ainvoke(input, config, **kwargs)
+
+    async def _ainvoke_hedged(
+        self,
+        input: Input,
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Output:
+        self._count_hedge('requests')
+        threshold = self._hedge_threshold()
+        i, config_i = self._select_config(run_manager, config, input)
+        if threshold is None or not self._can_hedge(i):
+            return await self._ainvoke_branch(i, input, config_i, **kwargs)
+        tasks: dict[asyncio.Task[Output], int] = {
+            asyncio.create_task(self._ainvoke_branch(i, input, config_i, **kwargs)): i,  # noqa
+        }
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=threshold)
+            if not done:
+                j = self._select_hedge(i, config)
+                self._count_hedge('hedged')
+                config_j = patch_config(
+                    derive_seed(config, 0),
+                    callbacks=run_manager.get_child(f'hedge:{j}'),
+                )
+                tasks[asyncio.create_task(self._ainvoke_branch(j, input, config_j, **kwargs))] = j  # noqa
+                pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-            ),
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] != i:
+                            self._count_hedge('hedge_won')
+                        return task.result()
+            # NOTE: all the runs failed, so the error of the selected one
+            #       is raised
+            primary = next(iter(tasks))
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def batch(
+        self,
+        inputs: list[Input],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Output]:
+        return self._batch_with_config(
+            partial(self._batch, return_exceptions=return_exceptions),
+            inputs,
+            config,
+            return_exceptions=return_exceptions,
+            **kwargs,
         )
 
-    @staticmethod
-    def _a_is_ge_0_le_b(a: float, b: float) -> bool:
-        """Check if a is less than or equal to b."""
-        return 0 <= a <= b
+    def _batch(
+        self,
+        inputs: list[Input],
+        run_manager: list[CallbackManagerForChainRun],
+        config: list[RunnableConfig],
+        return_exceptions: bool,
+        **kwargs: Any,
+    ) -> list[Output | Exception]:
+        groups = self._group(inputs, run_manager, config)
+        results: list[Output | Exception] = [None] * len(inputs)  # type: ignore # noqa
+
+        def run(i: int) -> None:
+            indices, inputs_, configs = groups[i]
+            with self._measure_batch(i, configs) as configs:
+                outputs = self._runnables[i].batch(
+                    inputs_,
+                    configs,
+                    return_exceptions=return_exceptions,
+                    **kwargs,
+                )
+            for j, output in zip(indices, outputs):
+                results[j] = output
+
+        # NOTE: the groups run one by one when max_concurrency is given so
+        #       that the limit applies to the whole batch, not to each group
+        if len(groups) == 1 or config[0].get('max_concurrency') is not None:
+            for i in groups:
+                run(i)
+        else:
+            with get_executor_for_config(config[0]) as executor:
+                list(executor.map(run, groups))
+        return results
+
+    async def abatch(
+        self,
+        inputs: list[Input],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Output]:
+        return await self._abatch_with_config(
+            partial(self._abatch, return_exceptions=return_exceptions),
+            inputs,
+            config,
+            return_exceptions=return_exceptions,
+            **kwargs,
+        )
+
+    async def _abatch(
+        self,
+        inputs: list[Input],
+        run_manager: list[AsyncCallbackManagerForChainRun],
+        config: list[RunnableConfig],
+        return_exceptions: bool,
+        **kwargs: Any,
+    ) -> list[Output | Exception]:
+        groups = self._group(inputs, run_manager, config)
+        results: list[Output | Exception] = [None] * len(inputs)  # type: ignore # noqa
+
+        async def run(i: int) -> None:
+            indices, inputs_, configs = groups[i]
+            with self._measure_batch(i, configs) as configs:
+                outputs = await self._runnables[i].abatch(
+                    inputs_,
+                    configs,
+                    return_exceptions=return_exceptions,
+                    **kwargs,
+                )
+            for j, output in zip(indices, outputs):
+                results[j] = output
+
+        if config[0].get('max_concurrency') is not None:
+            for i in groups:
+                await run(i)
+        else:
+            await asyncio.gather(*map(run, groups))
+        return results
+
+    def _group(
+        self,
+        inputs: list[Input],
+        run_manager: Sequence[CallbackManagerForChainRun | AsyncCallbackManagerForChainRun],  # noqa
+        config: list[RunnableConfig],
+    ) -> dict[int, tuple[list[int], list[Input], list[RunnableConfig]]]:
+        '''Draws the random values of all the inputs at once or selects the
+        runnables by the keys in the sticky routing, and groups
+        the indices, the inputs and the configs of the inputs by the
+        selected runnables.
+        '''
+        groups: dict[int, tuple[list[int], list[Input], list[RunnableConfig]]] = {}  # noqa
+        if self._routing == 'sticky':
+            selected = list(map(self._select_sticky, inputs))
+        else:
+            selected = list(map(self._select, self._draw(config[0], len(inputs))))  # noqa
+        for j, (input, i) in enumerate(zip(inputs, selected)):
+            indices, inputs_, configs = groups.setdefault(i, ([], [], []))
+            indices.append(j)
+            inputs_.append(input)
+            configs.append(patch_config(
+                derive_seed(config[j], j),
+                callbacks=run_manager[j].get_child(f'branch:{i}'),
+            ))
+        return groups
+
+    def stream(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Iterator[Output]:
+        yield from self.transform(iter([input]), config, **kwargs)
+
+    def transform(
+        self,
+        input: Iterator[Input],
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> Iterator[Output]:
+        yield from self._transform_stream_with_config(
+            input,
+            self._transform,
+            config,
+            **kwargs,
+        )
+
+    def _transform(
+        self,
+        input: Iterator[Input],
+        run_manager: CallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> Iterator[Output]:
+        if self._routing == 'sticky':
+            first = list(islice(input, 1))
+            if not first:
+                return
+            input = chain(first, input)
+            i, config = self._select_config(run_manager, config, first[0])
+        else:
+            i, config = self._select_config(run_manager, config, None)
+        with self._measure(i):
+            yield from self._runnables[i].transform(input, config, **kwargs)
+
+    async def astream(
+        self,
+        input: Input,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Output]:
+        async def input_aiter() -> AsyncIterator[Input]:
+            yield input
+
+        async for chunk in self.atransform(input_aiter(), config, **kwargs):
+            yield chunk
+
+    async def atransform(
+        self,
+        input: AsyncIterator[Input],
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Output]:
+        async for chunk in self._atransform_stream_with_config(
+            input,
+            self._atransform,
+            config,
+            **kwargs,
+        ):
+            yield chunk
+
+    async def _atransform(
+        self,
+        input: AsyncIterator[Input],
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+        **kwargs: Any,
+    ) -> AsyncIterator[Output]:
+        if self._routing == 'sticky':
+            try:
+                first = await input.__anext__()
+            except StopAsyncIteration:
+                return
+            input = _aprepend(first, input)
+            i, config = self._select_config(run_manager, config, first)
+        else:
+            i, config = self._select_config(run_manager, config, None)
+        with self._measure(i):
+            async for chunk in self._runnables[i].atransform(
+                input,
+                config,
+                **kwargs,
+            ):
+                yield chunk
+
+    @property
+    def InputType(self) -> type[Input]:
+        return self._runnables[0].InputType
 
-    def _raise_value_error(self, msg: str) -> None:
-        raise ValueError(msg)
+    @property
+    def OutputType(self) -> type[Output]:
+        return self._runnables[0].OutputType
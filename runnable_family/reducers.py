@@ -0,0 +1,195 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+import heapq
+from itertools import count
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Hashable,
+    Iterable,
+    NamedTuple,
+    TypeVar,
+    get_args,
+    get_origin,
+)
+
+T = TypeVar("T")
+Accumulator = TypeVar("Accumulator")
+Result = TypeVar("Result")
+
+
+class Reducer(ABC, Generic[T, Accumulator, Result]):
+    """Base class of incremental reducers which fold values one by one.
+    A reducer keeps only its accumulator, so the memory to aggregate values
+    does not depend on the number of the values. This is used by
+    `RunnableGacha` to aggregate the draws as soon as each draw finishes.
+
+    Subclasses must implement `initial` and `fold`, and may override
+    `result` to convert the accumulator into the final result.
+    Since the values are folded in the order of completion in
+    `RunnableGacha`, the result should not depend on the order of them.
+
+    Example:
+        >>> from runnable_family.reducers import Reducer
+        >>> class SumReducer(Reducer[int, int, int]):
+        ...     def initial(self):
+        ...         return 0
+        ...     def fold(self, acc, value):
+        ...         return acc + value
+        >>> SumReducer().reduce([1, 2, 3])
+        6
+    """
+
+    @abstractmethod
+    def initial(self) -> Accumulator:
+        """Returns a new accumulator."""
+
+    @abstractmethod
+    def fold(self, acc: Accumulator, value: T) -> Accumulator:
+        """Folds the value into the accumulator and returns it."""
+
+    def result(self, acc: Accumulator) -> Result:
+        """Returns the result of the accumulator."""
+        return acc  # type: ignore
+
+    def reduce(self, values: Iterable[T]) -> Result:
+        """Reduces the values at once."""
+        acc = self.initial()
+        for value in values:
+            acc = self.fold(acc, value)
+        return self.result(acc)
+
+    @property
+    def ResultType(self) -> Any:
+        """The type of the result, which is resolved from the type argument
+        `Result` of the subclass, or `Any` if it is not concrete.
+        """
+        for cls in type(self).__mro__:
+            for base in getattr(cls, '__orig_bases__', ()):
+                if get_origin(base) is Reducer:
+                    result_type = get_args(base)[2]
+                    if isinstance(result_type, TypeVar) or getattr(result_type, '__parameters__', None):  # noqa
+                        return Any
+                    return result_type
+        return Any
+
+
+class CountReducer(Reducer[T, Counter, Counter]):
+    """Reducer which counts the values, i.e. makes a histogram of them.
+
+    Args:
+        key: A callable that returns the hashable key of the value to count.
+            If None, the value itself is counted.
+
+    Example:
+        >>> from runnable_family.reducers import CountReducer
+        >>> CountReducer().reduce(['a', 'b', 'a'])
+        Counter({'a': 2, 'b': 1})
+        >>> CountReducer(key=len).reduce(['a', 'bb', 'c'])
+        Counter({1: 2, 2: 1})
+    """
+
+    def __init__(self, key: Callable[[T], Hashable] | None = None):
+        self._key = key
+
+    def initial(self) -> Counter:
+        return Counter()
+
+    def fold(self, acc: Counter, value: T) -> Counter:
+        acc[value if self._key is None else self._key(value)] += 1
+        return acc
+
+
+class MeanVariance(NamedTuple):
+    """Result of `MeanVarianceReducer`."""
+
+    n: int
+    mean: float
+    variance: float
+
+
+class MeanVarianceReducer(Reducer[float, tuple[int, float, float], MeanVariance]):  # noqa
+    """Reducer which computes the mean and the variance of the values
+    with Welford's online algorithm.
+
+    Args:
+        ddof: Delta degrees of freedom of the variance. The divisor of the
+            variance is `n - ddof`. Default is 0.
+
+    Example:
+        >>> from runnable_family.reducers import MeanVarianceReducer
+        >>> MeanVarianceReducer().reduce([1, 2, 3, 4])
+        MeanVariance(n=4, mean=2.5, variance=1.25)
+    """
+
+    def __init__(self, ddof: int = 0):
+        self._ddof = ddof
+
+    def initial(self) -> tuple[int, float, float]:
+        return 0, 0.0, 0.0
+
+    def fold(
+        self,
+        acc: tuple[int, float, float],
+        value: float,
+    ) -> tuple[int, float, float]:
+        n, mean, m2 = acc
+        n += 1
+        delta = value - mean
+        mean += delta / n
+        m2 += delta * (value - mean)
+        return n, mean, m2
+
+    def result(self, acc: tuple[int, float, float]) -> MeanVariance:
+        n, mean, m2 = acc
+        if n - self._ddof <= 0:
+            return MeanVariance(n, mean, float('nan'))
+        return MeanVariance(n, mean, m2 / (n - self._ddof))
+
+
+class TopKReducer(Reducer[T, list[tuple[object, int, T]], list[T]]):
+    """Reducer which keeps the k largest values.
+
+    Args:
+        k: The number of the values to keep.
+        key: A callable that returns the key to compare the values.
+            If None, the values themselves are compared.
+
+    Example:
+        >>> from runnable_family.reducers import TopKReducer
+        >>> TopKReducer(2).reduce([3, 1, 4, 1, 5])
+        [5, 4]
+        >>> TopKReducer(2, key=lambda s: -len(s)).reduce(['aa', 'b', 'ccc'])
+        ['b', 'aa']
+    """
+
+    def __init__(self, k: int, key: Callable[[T], object] | None = None):
+        if k < 1:
+            raise ValueError(f'k must be positive: k={k}')
+        self._k = k
+        self._key = key
+        self._counter = count()
+
+    def initial(self) -> list[tuple[object, int, T]]:
+        return []
+
+    def fold(
+        self,
+        acc: list[tuple[object, int, T]],
+        value: T,
+    ) -> list[tuple[object, int, T]]:
+        # NOTE: the counter breaks the ties without comparing the values
+        item = (
+            value if self._key is None else self._key(value),
+            next(self._counter),
+            value,
+        )
+        if len(acc) < self._k:
+            heapq.heappush(acc, item)  # type: ignore
+        else:
+            heapq.heappushpop(acc, item)  # type: ignore
+        return acc
+
+    def result(self, acc: list[tuple[object, int, T]]) -> list[T]:
+        return [value for _, _, value in sorted(acc, reverse=True)]  # type: ignore # noqa
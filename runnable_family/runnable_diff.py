@@ -5,11 +5,45 @@ from langchain_core.runnables import (
     RunnableSequence,
 )
 from langchain_core.runnables.base import Input, Output
-from typing import Iterable, TypeVar
+from typing import Any, Iterable, TypeVar
 
 InterMediate = TypeVar("InterMediate", covariant=True)
 
 
+def _steps(runnable: Runnable[Any, Any]) -> list[Runnable[Any, Any]]:
+    if isinstance(runnable, RunnableSequence):
+        return runnable.steps
+    return [runnable]
+
+
+def _sequence(steps: list[Runnable[Any, Any]]) -> Runnable[Any, Any]:
+    if len(steps) == 1:
+        return steps[0]
+    return RunnableSequence(*steps)
+
+
+def _split_shared_prefix(
+    runnable1: Runnable[Any, Any],
+    runnable2: Runnable[Any, Any],
+) -> tuple[
+    list[Runnable[Any, Any]],
+    Runnable[Any, Any],
+    Runnable[Any, Any],
+]:
+    '''Splits the leading steps shared by the runnables, which are the
+    identical objects, from the divergent suffixes.
+    The last step of each runnable is never shared, so that both of the
+    runnables run at least one step of their own.
+    '''
+    steps1, steps2 = _steps(runnable1), _steps(runnable2)
+    n = 0
+    while n < min(len(steps1), len(steps2)) - 1 and steps1[n] is steps2[n]:
+        n += 1
+    if n == 0:
+        return [], runnable1, runnable2
+    return steps1[:n], _sequence(steps1[n:]), _sequence(steps2[n:])
+
+
 class RunnableDiff(RunnableSequence[Input, Output]):
     """
     A runnable that computes the difference between the outputs of two
@@ -22,6 +56,20 @@ class RunnableDiff(RunnableSequence[Input, Output]):
         diff: A runnable or callable that takes two outputs and computes
             the difference between them. It should accept an iterable of
             two intermediate outputs and return the final output.
+        shared: A runnable which is run once on the input and whose output
+            is passed to both `runnable1` and `runnable2`, i.e. this is
+            equivalent to `RunnableDiff(shared | runnable1, shared | runnable2, diff)`
+            without running `shared` twice.
+            Default is None.
+        share_prefix: Whether to detect the leading steps of `runnable1`
+            and `runnable2` which are the identical objects, e.g.
+            `retriever` of `retriever | prompt1 | llm` and
+            `retriever | prompt2 | llm`, and to run them once. The last
+            step of each runnable is never shared. Note that the shared
+            steps produce one output for both of the runnables, so this
+            should not be used to compare the samples of a stochastic
+            chain. It is ignored if `shared` is given.
+            Default is False.
     Example:
         >>> from runnable_family.runnable_diff import RunnableDiff
         >>> from langchain_core.runnables import RunnableLambda, RunnableParallel
@@ -46,8 +94,19 @@ class RunnableDiff(RunnableSequence[Input, Output]):
         runnable1: Runnable[Input, InterMediate],
         runnable2: Runnable[Input, InterMediate],
         diff: Runnable[Iterable[InterMediate], Output],
+        shared: Runnable[Input, Any] | None = None,
+        share_prefix: bool = False,
     ):
+        prefix: list[Runnable[Any, Any]] = []
+        if shared is not None:
+            prefix = [shared]
+        elif share_prefix:
+            prefix, runnable1, runnable2 = _split_shared_prefix(
+                runnable1,
+                runnable2,
+            )
         super().__init__(
+            *prefix,
             RunnableParallel(**{  # type: ignore
                 'output1': runnable1,
                 'output2': runnable2,
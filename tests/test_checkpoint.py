@@ -0,0 +1,23 @@
+import sqlite3
+import sys
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+import pytest
+from runnable_family.checkpoint import sqlite_checkpointer
+
+
+def test_sqlite_checkpointer(tmp_path):
+    pytest.importorskip('langgraph.checkpoint.sqlite')
+    path = tmp_path / 'checkpoints.db'
+    with sqlite_checkpointer(path) as checkpointer:
+        assert isinstance(checkpointer, BaseCheckpointSaver)
+        assert path.exists()
+    # the connection is closed when the context exits
+    with pytest.raises(sqlite3.ProgrammingError):
+        checkpointer.conn.execute('SELECT 1')  # type: ignore
+
+
+def test_sqlite_checkpointer_without_sqlite_package(tmp_path, mocker):
+    mocker.patch.dict(sys.modules, {'langgraph.checkpoint.sqlite': None})
+    with pytest.raises(ImportError, match='runnable_family\\[sqlite\\]'):
+        sqlite_checkpointer(tmp_path / 'checkpoints.db')
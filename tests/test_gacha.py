@@ -1,6 +1,27 @@
-from langchain_core.runnables import RunnableLambda
+import asyncio
+from collections import Counter
+import gc
+import threading
+import time
+from typing import Any
+import weakref
+
+from langchain_core.callbacks import (
+    BaseCallbackHandler,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import (
+    ConfigurableField,
+    RunnableConfig,
+    RunnableLambda,
+)
 import pytest
-from runnable_family.gacha import RunnableGacha
+from runnable_family.gacha import DETERMINISTIC_CONFIG_KEY, RunnableGacha
+from runnable_family.random import SEED_CONFIG_KEY, RunnableRandomBranch
+from runnable_family.reducers import CountReducer, MeanVarianceReducer
 
 
 @pytest.mark.parametrize(
@@ -34,3 +55,617 @@ def test_runnable_gacha(
     assert invoke_spy.call_count == n
     assert chain.InputType == runnable.InputType
     assert chain.OutputType == list[runnable.OutputType]  # type: ignore
+
+
+class _InFlightCounter:
+    '''Async function counting how many calls are in flight.'''
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.current = 0
+        self.peak = 0
+        self.call_count = 0
+
+    async def __call__(self, x: int) -> int:
+        self.current += 1
+        self.call_count += 1
+        self.peak = max(self.peak, self.current)
+        await asyncio.sleep(self.delay)
+        self.current -= 1
+        return x + 1
+
+
+@pytest.mark.parametrize(
+    'n, max_concurrency, expected_peak',
+    [
+        (5, None, 5),
+        (5, 2, 2),
+        (5, 1, 1),
+        (0, 1, 0),
+    ]
+)
+def test_runnable_gacha_ainvoke(
+    n: int,
+    max_concurrency: int | None,
+    expected_peak: int,
+):
+    counter = _InFlightCounter()
+    chain = RunnableGacha(
+        RunnableLambda(counter),  # type: ignore
+        n,
+        max_concurrency=max_concurrency,
+    )
+    actual = asyncio.run(chain.ainvoke(1))
+    assert actual == [2] * n
+    assert counter.call_count == n
+    assert counter.peak == expected_peak
+
+
+def test_runnable_gacha_ainvoke_with_config_max_concurrency():
+    counter = _InFlightCounter()
+    chain = RunnableGacha(RunnableLambda(counter), 6)  # type: ignore
+    actual = asyncio.run(chain.ainvoke(1, {'max_concurrency': 3}))
+    assert actual == [2] * 6
+    assert counter.peak == 3
+
+
+def test_runnable_gacha_ainvoke_caps_default_workers(mocker):
+    mocker.patch('runnable_family.gacha._DEFAULT_MAX_WORKERS', 3)
+    counter = _InFlightCounter()
+    chain = RunnableGacha(RunnableLambda(counter), 10)  # type: ignore
+    actual = asyncio.run(chain.ainvoke(1))
+    assert actual == [2] * 10
+    assert counter.call_count == 10
+    assert counter.peak == 3
+
+
+def test_runnable_gacha_abatch_shares_max_concurrency():
+    counter = _InFlightCounter()
+    chain = RunnableGacha(RunnableLambda(counter), 4, max_concurrency=3)  # type: ignore # noqa
+    actual = asyncio.run(chain.abatch([1, 2, 3]))
+    assert actual == [[2] * 4, [3] * 4, [4] * 4]
+    assert counter.call_count == 12
+    assert counter.peak == 3
+
+
+def test_runnable_gacha_abatch_with_return_exceptions():
+    def raise_if_negative(x: int) -> int:
+        if x < 0:
+            raise ValueError(x)
+        return x
+
+    chain = RunnableGacha(RunnableLambda(raise_if_negative), 2)
+    actual = asyncio.run(chain.abatch([1, -1], return_exceptions=True))
+    assert actual[0] == [1, 1]
+    assert isinstance(actual[1], ValueError)
+    with pytest.raises(ValueError):
+        asyncio.run(chain.abatch([1, -1]))
+
+
+@pytest.mark.parametrize(
+    'n, max_concurrency',
+    [
+        (-1, None),
+        (1, 0),
+    ]
+)
+def test_runnable_gacha_with_invalid_arguments(
+    n: int,
+    max_concurrency: int | None,
+):
+    with pytest.raises(ValueError):
+        RunnableGacha(RunnableLambda(lambda x: x), n, max_concurrency)
+
+
+def _sleep_by_input_index(delays: list[float]):
+    '''Returns a sync and an async functions sleeping by the call order.'''
+    counter = iter(range(len(delays)))
+
+    def func(x: int) -> int:
+        i = next(counter)
+        time.sleep(delays[i])
+        return i
+
+    async def afunc(x: int) -> int:
+        i = next(counter)
+        await asyncio.sleep(delays[i])
+        return i
+
+    return func, afunc
+
+
+def test_runnable_gacha_stream_yields_draws_in_completion_order():
+    func, _ = _sleep_by_input_index([0.3, 0.0, 0.15])
+    chain = RunnableGacha(RunnableLambda(func), 3, max_concurrency=3)
+    actual = list(chain.stream_draws(0))
+    assert sorted(i for i, _ in actual) == [0, 1, 2]
+    # NOTE: the outputs are the call orders of the draws
+    assert [output for _, output in actual] == [1, 2, 0]
+
+
+def test_runnable_gacha_astream_yields_draws_in_completion_order():
+    _, afunc = _sleep_by_input_index([0.3, 0.0, 0.15])
+    chain = RunnableGacha(RunnableLambda(afunc), 3)  # type: ignore
+
+    async def collect():
+        return [draw async for draw in chain.astream_draws(0)]
+
+    actual = asyncio.run(collect())
+    assert sorted(i for i, _ in actual) == [0, 1, 2]
+    # NOTE: the outputs are the call orders of the draws
+    assert [output for _, output in actual] == [1, 2, 0]
+
+
+def test_runnable_gacha_with_random_branch_seed():
+    chain = RunnableGacha(
+        RunnableRandomBranch(lambda x: 'a', lambda x: 'b'),  # type: ignore
+        10,
+    )
+    config: RunnableConfig = {'configurable': {SEED_CONFIG_KEY: 7}}
+    expected = chain.invoke(0, config)
+    assert set(expected) == {'a', 'b'}
+    # reproducible by the seed per call
+    assert chain.invoke(0, config) == expected
+    assert asyncio.run(chain.ainvoke(0, config)) == expected
+
+
+def test_runnable_gacha_stream_yields_list():
+    chain = RunnableGacha(RunnableLambda(lambda x: x + 1), 3)
+    assert list(chain.stream(1)) == [[2, 2, 2]]
+
+    async def collect():
+        return [chunk async for chunk in chain.astream(1)]
+
+    assert asyncio.run(collect()) == [[2, 2, 2]]
+
+
+def test_runnable_gacha_in_chain_receives_none():
+    chain = RunnableLambda(lambda x: None) | RunnableGacha(
+        RunnableLambda(lambda x: x),
+        2,
+    )
+    assert chain.invoke(0) == [None, None]
+    assert list(chain.stream(0)) == [[None, None]]
+
+
+def test_runnable_gacha_in_chain_passes_list():
+    chain = RunnableGacha(RunnableLambda(lambda x: x + 1), 3) | RunnableLambda(sum)  # noqa
+    assert list(chain.stream(1)) == [6]
+    assert chain.invoke(1) == 6
+
+    async def collect():
+        return [chunk async for chunk in chain.astream(1)]
+
+    assert asyncio.run(collect()) == [6]
+
+
+@pytest.mark.parametrize(
+    'k, predicate, expected',
+    [
+        (1, None, [1]),
+        (2, None, [1, 2]),
+        (None, lambda x: x % 2 == 0, [0, 2]),
+        (1, lambda x: x % 2 == 0, [2]),
+        (5, lambda x: x % 2 == 0, [0, 2]),
+    ]
+)
+def test_runnable_gacha_with_early_termination(
+    k: int | None,
+    predicate,
+    expected: list[int],
+):
+    # NOTE: the draw 0 is the slowest one
+    func, afunc = _sleep_by_input_index([0.5, 0.0, 0.1])
+    chain = RunnableGacha(
+        RunnableLambda(func, afunc=afunc),
+        3,
+        max_concurrency=3,
+        k=k,
+        predicate=predicate,
+    )
+    start = time.perf_counter()
+    actual = chain.invoke(0)
+    elapsed = time.perf_counter() - start
+    assert sorted(actual) == expected
+    if expected == [1] or expected == [2]:
+        # the slowest draw is not waited for
+        assert elapsed < 0.4
+
+
+@pytest.mark.parametrize(
+    'k, predicate, expected',
+    [
+        (1, None, [1]),
+        (2, None, [1, 2]),
+        (None, lambda x: x % 2 == 0, [0, 2]),
+        (1, lambda x: x % 2 == 0, [2]),
+    ]
+)
+def test_runnable_gacha_with_early_termination_async(
+    k: int | None,
+    predicate,
+    expected: list[int],
+):
+    finished: list[int] = []
+    delays = [0.5, 0.0, 0.1]
+    order = iter(range(len(delays)))
+
+    async def afunc(x: int) -> int:
+        i = next(order)
+        await asyncio.sleep(delays[i])
+        finished.append(i)
+        return i
+
+    chain = RunnableGacha(
+        RunnableLambda(afunc),  # type: ignore
+        3,
+        k=k,
+        predicate=predicate,
+    )
+    actual = asyncio.run(chain.ainvoke(0))
+    assert sorted(actual) == expected
+    if 0 not in expected:
+        # the slowest draw is cancelled
+        assert 0 not in finished
+
+
+@pytest.mark.parametrize(
+    'k, predicate, expected',
+    [
+        (None, None, [2, 2, 2]),
+        (2, None, [2, 2]),
+        (None, lambda x: x > 2, []),
+    ]
+)
+def test_runnable_gacha_with_batch_dispatch(
+    k: int | None,
+    predicate,
+    expected: list[int],
+    mocker,
+):
+    runnable: RunnableLambda[int, int] = RunnableLambda(lambda x: x + 1)
+    batch_spy = mocker.spy(runnable, 'batch')
+    abatch_spy = mocker.spy(runnable, 'abatch')
+    chain = RunnableGacha(
+        runnable,
+        3,
+        max_concurrency=2,
+        k=k,
+        predicate=predicate,
+        dispatch='batch',
+    )
+    assert chain.invoke(1) == expected
+    assert batch_spy.call_count == 1
+    inputs, configs = batch_spy.call_args.args
+    assert inputs == [1, 1, 1]
+    assert [config['max_concurrency'] for config in configs] == [2, 2, 2]
+    assert asyncio.run(chain.ainvoke(1)) == expected
+    assert abatch_spy.call_count == 1
+    assert abatch_spy.call_args.args[0] == [1, 1, 1]
+
+
+def test_runnable_gacha_with_invalid_dispatch():
+    with pytest.raises(ValueError):
+        RunnableGacha(RunnableLambda(lambda x: x), dispatch='foo')  # type: ignore # noqa
+
+
+@pytest.mark.parametrize('max_concurrency', [1, 2, 4])
+def test_runnable_gacha_invoke_with_max_concurrency(max_concurrency: int):
+    thread_ids: set[int] = set()
+
+    def func(x: int) -> int:
+        thread_ids.add(threading.get_ident())
+        time.sleep(0.001)
+        return x
+
+    chain = RunnableGacha(
+        RunnableLambda(func),
+        100,
+        max_concurrency=max_concurrency,
+    )
+    assert chain.invoke(1) == [1] * 100
+    assert 1 <= len(thread_ids) <= max_concurrency
+
+
+def test_runnable_gacha_propagates_error():
+    calls = iter(range(5))
+
+    def raise_at_third_call(x: int) -> int:
+        if next(calls) == 2:
+            raise ValueError(x)
+        return x
+
+    chain = RunnableGacha(RunnableLambda(raise_at_third_call), 5, max_concurrency=1)  # noqa
+    with pytest.raises(ValueError):
+        chain.invoke(1)
+
+    async def araise(x: int) -> int:
+        raise ValueError(x)
+
+    achain = RunnableGacha(RunnableLambda(araise), 5, max_concurrency=2)  # type: ignore # noqa
+    with pytest.raises(ValueError):
+        asyncio.run(achain.ainvoke(1))
+
+
+class _FakeMultiSampleChatModel(BaseChatModel):
+    '''Fake chat model which returns `n` completions per request.'''
+
+    n: int = 1
+    streaming: bool = False
+    temperature: float | None = None
+    request_count: int = 0
+    ignores_n: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-multi-sample'
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.request_count += 1
+        n = self.n if self.ignores_n else kwargs.get('n', self.n)
+        return ChatResult(generations=[
+            ChatGeneration(message=AIMessage(content=f'{messages[-1].content}:{i}'))  # noqa
+            for i in range(n)
+        ])
+
+
+def test_runnable_gacha_with_multi_sample_dispatch():
+    model = _FakeMultiSampleChatModel()
+    chain = RunnableGacha(model, 3, dispatch='multi_sample')
+    actual = chain.invoke('hi')
+    assert [message.content for message in actual] == ['hi:0', 'hi:1', 'hi:2']  # noqa
+    assert model.request_count == 1
+    actual = asyncio.run(chain.ainvoke('hi'))
+    assert [message.content for message in actual] == ['hi:0', 'hi:1', 'hi:2']  # noqa
+    assert model.request_count == 2
+
+
+def test_runnable_gacha_with_multi_sample_dispatch_ignoring_n():
+    model = _FakeMultiSampleChatModel(ignores_n=True)
+    chain = RunnableGacha(model, 3, dispatch='multi_sample')
+    # the missing completions are drawn one by one
+    assert len(chain.invoke('hi')) == 3
+    assert model.request_count == 3
+    assert len(asyncio.run(chain.ainvoke('hi'))) == 3
+    assert model.request_count == 6
+
+
+def test_runnable_gacha_with_multi_sample_dispatch_and_k():
+    model = _FakeMultiSampleChatModel()
+    chain = RunnableGacha(
+        model,
+        3,
+        k=1,
+        predicate=lambda message: message.content.endswith('1'),
+        dispatch='multi_sample',
+    )
+    assert [message.content for message in chain.invoke('hi')] == ['hi:1']
+
+
+def test_runnable_gacha_with_auto_dispatch():
+    model = _FakeMultiSampleChatModel()
+    chain = RunnableGacha(model, 3, dispatch='auto')
+    assert len(chain.invoke('hi')) == 3
+    assert model.request_count == 1
+
+    streaming_model = _FakeMultiSampleChatModel(streaming=True)
+    chain = RunnableGacha(streaming_model, 3, dispatch='auto')
+    assert len(chain.invoke('hi')) == 3
+    assert streaming_model.request_count == 3
+
+    runnable: RunnableLambda[int, int] = RunnableLambda(lambda x: x + 1)
+    assert RunnableGacha(runnable, 3, dispatch='auto').invoke(1) == [2, 2, 2]
+
+
+def test_runnable_gacha_with_multi_sample_dispatch_for_non_chat_model():
+    with pytest.raises(ValueError):
+        RunnableGacha(RunnableLambda(lambda x: x), dispatch='multi_sample')
+
+
+class _CustomEventRecorder(BaseCallbackHandler):
+    '''Callback handler recording the custom events.'''
+
+    def __init__(self):
+        self.events: list[tuple[str, Any]] = []
+
+    def on_custom_event(self, name: str, data: Any, **kwargs: Any) -> None:
+        self.events.append((name, data))
+
+
+@pytest.mark.parametrize(
+    'n, outputs, unique_key, max_attempts, expected, expected_attempts',
+    [
+        (3, [1, 1, 2, 2, 3], None, None, [1, 2, 3], 5),
+        (3, [1, 1, 2, 2, 3], None, 4, [1, 2], 4),
+        (3, [1, 2, 3, 4, 5], None, None, [1, 2, 3], 3),
+        (2, [1, 3, 5, 2, 4, 6], lambda x: x % 2, None, [1, 2], 4),
+        (3, [1, 1, 1, 1, 1, 1], None, None, [1], 6),
+    ]
+)
+def test_runnable_gacha_with_unique_key(
+    n: int,
+    outputs: list[int],
+    unique_key,
+    max_attempts: int | None,
+    expected: list[int],
+    expected_attempts: int,
+):
+    for run in ('sync', 'async'):
+        calls = iter(outputs)
+
+        def func(x: int) -> int:
+            return next(calls)
+
+        recorder = _CustomEventRecorder()
+        chain = RunnableGacha(
+            RunnableLambda(func),
+            n,
+            max_concurrency=1,
+            unique_key=unique_key or (lambda x: x),
+            max_attempts=max_attempts,
+        )
+        if run == 'sync':
+            actual = chain.invoke(0, {'callbacks': [recorder]})
+        else:
+            actual = asyncio.run(chain.ainvoke(0, {'callbacks': [recorder]}))
+        assert actual == expected
+        assert recorder.events == [
+            (
+                'gacha_attempts',
+                {'n_attempts': expected_attempts, 'n_outputs': len(expected)},  # noqa
+            ),
+        ]
+
+
+def test_runnable_gacha_with_unique_key_redraws_only_duplicates(mocker):
+    runnable: RunnableLambda[int, int] = RunnableLambda(lambda x: x)
+    batch_spy = mocker.spy(runnable, 'batch')
+    calls = iter([[1, 1, 2, 1], [1, 3], [4]])
+    batch_spy.side_effect = lambda inputs, *args, **kwargs: next(calls)
+    chain = RunnableGacha(
+        runnable,
+        4,
+        dispatch='batch',
+        unique_key=lambda x: x,
+    )
+    assert chain.invoke(0) == [1, 2, 3, 4]
+    assert [len(call.args[0]) for call in batch_spy.call_args_list] == [4, 2, 1]  # noqa
+
+
+def test_runnable_gacha_with_invalid_max_attempts():
+    with pytest.raises(ValueError):
+        RunnableGacha(RunnableLambda(lambda x: x), 3, unique_key=hash, max_attempts=2)  # noqa
+
+
+def test_runnable_gacha_with_reducer():
+    calls = iter(range(10))
+    chain = RunnableGacha(
+        RunnableLambda(lambda x: next(calls) % 3),
+        10,
+        max_concurrency=1,
+        reducer=CountReducer(),
+    )
+    assert chain.invoke(0) == Counter({0: 4, 1: 3, 2: 3})
+    assert chain.OutputType == Counter
+
+    achain = RunnableGacha(
+        RunnableLambda(lambda x: float(x)),
+        4,
+        reducer=MeanVarianceReducer(),
+    )
+    assert asyncio.run(achain.ainvoke(2)) == (4, 2.0, 0.0)
+
+    stream_chain = RunnableGacha(
+        RunnableLambda(lambda x: x),
+        3,
+        reducer=CountReducer(),
+    )
+    assert sorted(stream_chain.stream_draws(1)) == [(0, 1), (1, 1), (2, 1)]
+    assert list(stream_chain.stream(1)) == [Counter({1: 3})]
+
+
+def test_runnable_gacha_with_reducer_drops_outputs():
+    class _Output:
+        pass
+
+    alive: weakref.WeakSet[_Output] = weakref.WeakSet()
+
+    def func(x: int) -> _Output:
+        output = _Output()
+        alive.add(output)
+        return output
+
+    chain = RunnableGacha(
+        RunnableLambda(func),
+        100,
+        max_concurrency=1,
+        reducer=CountReducer(key=type),
+    )
+    assert chain.invoke(0) == Counter({_Output: 100})
+    gc.collect()
+    assert len(alive) == 0
+
+
+def test_runnable_gacha_with_deterministic(mocker):
+    runnable = RunnableLambda(lambda x: x + 1)
+    spy = mocker.spy(runnable, 'invoke')
+    aspy = mocker.spy(runnable, 'ainvoke')
+    chain = RunnableGacha(runnable, 5, deterministic=True)
+    assert chain.invoke(1) == [2] * 5
+    assert spy.call_count == 1
+    assert asyncio.run(chain.ainvoke(1)) == [2] * 5
+    assert aspy.call_count == 1
+    assert sorted(chain.stream_draws(1)) == [(i, 2) for i in range(5)]
+    assert spy.call_count == 2
+
+
+def test_runnable_gacha_with_deterministic_config(mocker):
+    runnable = RunnableLambda(lambda x: x + 1)
+    spy = mocker.spy(runnable, 'invoke')
+    chain = RunnableGacha(runnable, 3, max_concurrency=1)
+    config = {'configurable': {DETERMINISTIC_CONFIG_KEY: True}}
+    assert chain.invoke(1, config) == [2, 2, 2]
+    assert spy.call_count == 1
+
+    chain = RunnableGacha(runnable, 3, max_concurrency=1, deterministic=True)
+    config = {'configurable': {DETERMINISTIC_CONFIG_KEY: False}}
+    assert chain.invoke(1, config) == [2, 2, 2]
+    assert spy.call_count == 4
+
+
+@pytest.mark.parametrize(
+    'temperature, expected_request_count',
+    [
+        (0, 1),
+        (0.7, 3),
+        (None, 3),
+    ]
+)
+def test_runnable_gacha_with_auto_deterministic(
+    temperature: float | None,
+    expected_request_count: int,
+):
+    model = _FakeMultiSampleChatModel(temperature=temperature)
+    chain = RunnableGacha(model, 3, max_concurrency=1, deterministic='auto')
+    assert len(chain.invoke('hi')) == 3
+    assert model.request_count == expected_request_count
+
+
+def test_runnable_gacha_with_auto_deterministic_per_call():
+    model = _FakeMultiSampleChatModel(temperature=0.7)
+    configurable = model.configurable_fields(
+        temperature=ConfigurableField(id='temperature'),
+    )
+    chain = RunnableGacha(
+        configurable,
+        3,
+        max_concurrency=1,
+        deterministic='auto',
+    )
+    # NOTE: the replicated output is the same object
+    actual = chain.invoke('hi', {'configurable': {'temperature': 0}})
+    assert all(message is actual[0] for message in actual)
+    actual = chain.invoke('hi')
+    assert not any(message is actual[0] for message in actual[1:])
+
+    bound = _FakeMultiSampleChatModel(temperature=0.7)
+    chain = RunnableGacha(
+        bound.bind(temperature=0),
+        3,
+        max_concurrency=1,
+        deterministic='auto',
+    )
+    assert len(chain.invoke('hi')) == 3
+    assert bound.request_count == 1
+
+
+def test_runnable_gacha_with_deterministic_and_unique_key():
+    runnable = RunnableLambda(lambda x: x)
+    chain = RunnableGacha(runnable, 3, unique_key=str, deterministic=True)
+    assert chain.invoke(1) == [1]
@@ -1,11 +1,24 @@
+import asyncio
+from contextlib import ExitStack
+import threading
+from typing import Any
+
 from langchain_core.runnables import (
     Runnable,
+    RunnableConfig,
     RunnableLambda,
     RunnablePassthrough,
 )
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.errors import GraphRecursionError
 import pytest
+from runnable_family.checkpoint import sqlite_checkpointer
 from runnable_family.loopback import (
+    LoopbackCycleError,
+    RunnableBeamSearch,
     RunnableLoopback,
+    RunnableNLoop,
 )
 
 
@@ -107,3 +120,659 @@ def test_runnable_loopback_with_n_loop(
 
     # check whether get_graph can be called
     loopback.get_graph()
+
+
+@pytest.mark.parametrize('engine', ['graph', 'native'])
+def test_runnable_loopback_with_engine(engine: str, mocker):
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x+1)
+    condition: Runnable[int, bool] = RunnableLambda(lambda x: x < 10)
+    loopback: Runnable[int, int] = RunnableLambda(lambda x: x * 2)
+    runnable_invoke_spy = mocker.spy(runnable, 'invoke')
+    loopback_invoke_spy = mocker.spy(loopback, 'invoke')
+    chain = RunnableLoopback(
+        runnable=runnable,
+        condition=condition,
+        loopback=loopback,
+        engine=engine,  # type: ignore
+    )
+    # 0 -> 1 -> 2 -> 3 -> 6 -> 7 -> 14 -> 15
+    assert chain.invoke(0) == 15
+    assert runnable_invoke_spy.call_count == 4
+    if engine == 'native':
+        assert loopback_invoke_spy.call_count == 3
+
+
+def test_runnable_loopback_with_native_engine_has_no_recursion_limit():
+    kwargs = dict(
+        runnable=RunnableLambda(lambda x: x+1),
+        condition=lambda x: x < 1000,
+        loopback=RunnablePassthrough(),
+    )
+    config: RunnableConfig = {'recursion_limit': 25}
+    assert RunnableLoopback(**kwargs, engine='native').invoke(0, config) == 1000  # type: ignore # noqa
+    with pytest.raises(GraphRecursionError):
+        RunnableLoopback(**kwargs, engine='graph').invoke(0, config)  # type: ignore # noqa
+
+
+def test_runnable_loopback_with_native_engine_tags_iterations():
+    tags: list[list[str]] = []
+    runnable = RunnableLambda(lambda x: x+1).with_listeners(
+        on_start=lambda run: tags.append(run.tags),
+    )
+    chain = RunnableLoopback(
+        runnable=runnable,
+        condition=lambda x: x < 3,
+        loopback=RunnablePassthrough(),
+        engine='native',
+    )
+    assert chain.invoke(0) == 3
+    assert [
+        [tag for tag in tags_ if tag.startswith('iteration:')]
+        for tags_ in tags
+    ] == [['iteration:0'], ['iteration:1'], ['iteration:2']]
+
+
+@pytest.mark.parametrize('n', [2, 3])
+def test_runnable_loopback_with_n_loop_and_native_engine(n: int):
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x+1)
+    loopback: Runnable[int, int] = RunnablePassthrough()
+    chain = RunnableLoopback.with_n_loop(
+        n=n,
+        runnable=runnable,
+        loopback=loopback,
+        engine='native',
+    )
+    assert chain.invoke(0) == n
+
+
+def test_runnable_loopback_with_invalid_engine():
+    with pytest.raises(ValueError):
+        RunnableLoopback(
+            runnable=RunnablePassthrough(),
+            condition=lambda x: False,
+            loopback=RunnablePassthrough(),
+            engine='invalid',  # type: ignore
+        )
+
+
+@pytest.mark.parametrize('engine', ['graph', 'native'])
+def test_runnable_loopback_async(engine: str):
+    threads: set[threading.Thread] = set()
+
+    async def afunc(x: int) -> int:
+        threads.add(threading.current_thread())
+        await asyncio.sleep(0)
+        return x + 1
+
+    async def acondition(x: int) -> bool:
+        threads.add(threading.current_thread())
+        return x < 10
+
+    async def aloopback(x: int) -> int:
+        threads.add(threading.current_thread())
+        return x * 2
+
+    # NOTE: the runnables without sync functions cannot be invoked
+    #       in a thread executor.
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=RunnableLambda(afunc),
+        condition=RunnableLambda(acondition),
+        loopback=RunnableLambda(aloopback),
+        engine=engine,  # type: ignore
+    )
+
+    async def main() -> tuple[int, list[int], list[tuple[int, int]]]:
+        return (
+            await chain.ainvoke(0),
+            await chain.abatch([0, 5, 10]),
+            [chunk async for chunk in chain.astream_iterations(0)],
+        )
+
+    assert asyncio.run(main()) == (
+        15,
+        [15, 13, 11],
+        [(0, 1), (1, 3), (2, 7), (3, 15)],
+    )
+    assert threads == {threading.main_thread()}
+
+
+@pytest.mark.parametrize('engine', ['graph', 'native'])
+def test_runnable_loopback_stream(engine: str, mocker):
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x+1)
+    runnable_invoke_spy = mocker.spy(runnable, 'invoke')
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=runnable,
+        condition=lambda x: x < 10,
+        loopback=RunnableLambda(lambda x: x * 2),
+        engine=engine,  # type: ignore
+    )
+    expected = [(0, 1), (1, 3), (2, 7), (3, 15)]
+    assert list(chain.stream_iterations(0)) == expected
+
+    async def main() -> list[tuple[int, int]]:
+        return [chunk async for chunk in chain.astream_iterations(0)]
+
+    assert asyncio.run(main()) == expected
+
+    # stream yields the final output as the only chunk
+    assert list(chain.stream(0)) == [15]
+
+    async def amain_final() -> list[int]:
+        return [chunk async for chunk in chain.astream(0)]
+
+    assert asyncio.run(amain_final()) == [15]
+
+    # stop early from the consumer side
+    runnable_invoke_spy.reset_mock()
+    for i, _ in chain.stream_iterations(0):
+        if i == 1:
+            break
+    assert runnable_invoke_spy.call_count == 2
+
+    # the downstream runnables receive the final output
+    assert list((chain | RunnableLambda(lambda x: x - 1)).stream(0)) == [14]
+
+    async def amain() -> list[int]:
+        return [
+            chunk
+            async for chunk in (chain | RunnableLambda(lambda x: x - 1)).astream(0)  # noqa
+        ]
+
+    assert asyncio.run(amain()) == [14]
+
+
+@pytest.mark.parametrize('engine', ['graph', 'native'])
+def test_runnable_loopback_in_chain_receives_none(engine: str):
+    loopback: RunnableLoopback[Any, Any] = RunnableLoopback(
+        runnable=RunnableLambda(lambda x: x),
+        condition=lambda x: False,
+        loopback=RunnablePassthrough(),
+        engine=engine,  # type: ignore
+    )
+    chain: Runnable[Any, Any] = RunnableLambda(lambda x: None) | loopback
+    assert chain.invoke(0) is None
+    assert list(chain.stream(0)) == [None]
+
+    async def main() -> list[Any]:
+        return [chunk async for chunk in chain.astream(0)]
+
+    assert asyncio.run(main()) == [None]
+
+
+def test_runnable_loopback_does_not_leak_itself_to_components():
+    seen: list[dict[str, Any]] = []
+
+    def record(x: int, config: RunnableConfig) -> int:
+        seen.append(config['configurable'])
+        return x
+
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=RunnableLambda(lambda x, config: record(x + 1, config)),
+        condition=RunnableLambda(lambda x, config: record(x, config) < 2),
+        loopback=RunnableLambda(record),
+    )
+    config: RunnableConfig = {'configurable': {'user_key': 'value'}}
+    assert chain.invoke(0, config) == 2
+    assert asyncio.run(chain.ainvoke(0, config)) == 2
+    # runnable, condition and loopback in the first iteration, and
+    # runnable and condition in the second one for each call
+    assert len(seen) == 10
+    for configurable in seen:
+        assert configurable['user_key'] == 'value'
+        assert all(not key.startswith('__runnable') for key in configurable)
+
+
+class _FlakyIncrement:
+    '''Increments the input, failing once when the input is `fail_on`.'''
+
+    def __init__(self, fail_on: int):
+        self.fail_on: int | None = fail_on
+        self.inputs: list[int] = []
+
+    def __call__(self, x: int) -> int:
+        self.inputs.append(x)
+        if x == self.fail_on:
+            self.fail_on = None
+            raise RuntimeError('transient error')
+        return x + 1
+
+
+@pytest.mark.parametrize('checkpointer_type', ['memory', 'sqlite'])
+def test_runnable_loopback_with_checkpointer_resumes(
+    checkpointer_type: str,
+    tmp_path,
+):
+    with ExitStack() as stack:
+        if checkpointer_type == 'memory':
+            checkpointer: BaseCheckpointSaver = InMemorySaver()
+        else:
+            pytest.importorskip('langgraph.checkpoint.sqlite')
+            checkpointer = stack.enter_context(
+                sqlite_checkpointer(tmp_path / 'checkpoints.db'),
+            )
+        func = _FlakyIncrement(fail_on=5)
+        chain: RunnableLoopback[int, int] = RunnableLoopback(
+            runnable=RunnableLambda(func),
+            condition=lambda x: x < 8,
+            loopback=RunnablePassthrough(),
+            checkpointer=checkpointer,
+        )
+        config: RunnableConfig = {'configurable': {'thread_id': 'thread-1'}}  # noqa
+        with pytest.raises(RuntimeError):
+            chain.invoke(0, config)
+        assert func.inputs == [0, 1, 2, 3, 4, 5]
+        # resume from the last completed step, ignoring the input
+        assert chain.invoke(100, config) == 8
+        assert func.inputs == [0, 1, 2, 3, 4, 5, 5, 6, 7]
+        # a completed thread starts a new run
+        assert chain.invoke(6, config) == 8
+        assert func.inputs == [0, 1, 2, 3, 4, 5, 5, 6, 7, 6, 7]
+        # the other threads are independent
+        assert chain.invoke(7, {'configurable': {'thread_id': 'thread-2'}}) == 8  # noqa
+
+
+def test_runnable_loopback_with_checkpointer_resumes_async():
+    func = _FlakyIncrement(fail_on=2)
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=RunnableLambda(func),
+        condition=lambda x: x < 4,
+        loopback=RunnablePassthrough(),
+        checkpointer=InMemorySaver(),
+    )
+    config: RunnableConfig = {'configurable': {'thread_id': 'thread-1'}}
+
+    async def main() -> tuple[int, list[tuple[int, int]]]:
+        with pytest.raises(RuntimeError):
+            await chain.ainvoke(0, config)
+        output = await chain.ainvoke(0, config)
+        with pytest.raises(RuntimeError):
+            func.fail_on = 1
+            await chain.ainvoke(0, config)
+        return output, [
+            chunk async for chunk in chain.astream_iterations(0, config)
+        ]
+
+    output, chunks = asyncio.run(main())
+    assert output == 4
+    # NOTE: the indices are counted from the resumed step
+    assert chunks == [(0, 2), (1, 3), (2, 4)]
+    assert func.inputs == [0, 1, 2, 2, 3, 0, 1, 1, 2, 3]
+
+
+def test_runnable_loopback_with_checkpointer_and_native_engine():
+    with pytest.raises(ValueError):
+        RunnableLoopback(
+            runnable=RunnablePassthrough(),
+            condition=lambda x: False,
+            loopback=RunnablePassthrough(),
+            engine='native',
+            checkpointer=InMemorySaver(),
+        )
+
+
+@pytest.mark.parametrize('engine', ['graph', 'native'])
+def test_runnable_loopback_with_lockstep_batch(engine: str, mocker):
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x+1)
+    condition: Runnable[int, bool] = RunnableLambda(lambda x: x < 10)
+    loopback: Runnable[int, int] = RunnablePassthrough()
+    runnable_batch_spy = mocker.spy(runnable, 'batch')
+    runnable_abatch_spy = mocker.spy(runnable, 'abatch')
+    condition_batch_spy = mocker.spy(condition, 'batch')
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=runnable,
+        condition=condition,
+        loopback=loopback,
+        engine=engine,  # type: ignore
+        batch_mode='lockstep',
+    )
+    # the items finish after 10, 5 and 2 iterations respectively
+    inputs = [0, 5, 8]
+    expected_sizes = [3, 3, 2, 2, 2, 1, 1, 1, 1, 1]
+    assert chain.batch(inputs) == [10, 10, 10]
+    assert [
+        len(call.args[0]) for call in runnable_batch_spy.call_args_list
+    ] == expected_sizes
+    assert condition_batch_spy.call_count == len(expected_sizes)
+    assert asyncio.run(chain.abatch(inputs)) == [10, 10, 10]
+    assert [
+        len(call.args[0]) for call in runnable_abatch_spy.call_args_list
+    ] == expected_sizes
+    assert chain.batch([]) == []
+
+
+def test_runnable_loopback_with_lockstep_batch_and_exceptions():
+    def func(x: int) -> int:
+        if x == 3:
+            raise RuntimeError('error')
+        return x + 1
+
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=RunnableLambda(func),
+        condition=lambda x: x < 5,
+        loopback=RunnablePassthrough(),
+        batch_mode='lockstep',
+    )
+    actual = chain.batch([0, 4], return_exceptions=True)
+    assert isinstance(actual[0], RuntimeError)
+    assert actual[1] == 5
+    with pytest.raises(RuntimeError):
+        chain.batch([0, 4])
+    actual = asyncio.run(chain.abatch([0, 4], return_exceptions=True))
+    assert isinstance(actual[0], RuntimeError)
+    assert actual[1] == 5
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(batch_mode='invalid'),
+        dict(batch_mode='lockstep', checkpointer=InMemorySaver()),
+    ]
+)
+def test_runnable_loopback_with_invalid_batch_mode(kwargs: dict):
+    with pytest.raises(ValueError):
+        RunnableLoopback(
+            runnable=RunnablePassthrough(),
+            condition=lambda x: False,
+            loopback=RunnablePassthrough(),
+            **kwargs,
+        )
+
+
+def test_runnable_loopback_with_n_loop_and_lockstep_batch():
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x+1)
+    loopback: Runnable[int, int] = RunnablePassthrough()
+    chain = RunnableLoopback.with_n_loop(
+        n=3,
+        runnable=runnable,
+        loopback=loopback,
+        batch_mode='lockstep',
+    )
+    assert chain.batch([0, 10]) == [3, 13]
+
+
+@pytest.mark.parametrize(
+    'n, input_obj, expected',
+    [
+        (0, 0, 0),
+        (1, 0, 1),
+        (2, 0, 3),
+        (3, 0, 7),
+        (3, -1, 3),
+    ]
+)
+def test_runnable_n_loop(
+    n: int,
+    input_obj: int,
+    expected: int,
+    mocker,
+):
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: x+1)
+    loopback: Runnable[int, int] = RunnableLambda(lambda x: x * 2)
+    runnable_invoke_spy = mocker.spy(runnable, 'invoke')
+    loopback_invoke_spy = mocker.spy(loopback, 'invoke')
+    chain: RunnableNLoop[int, int] = RunnableNLoop(n, runnable, loopback)
+    assert chain.invoke(input_obj) == expected
+    assert runnable_invoke_spy.call_count == n
+    assert loopback_invoke_spy.call_count == max(n - 1, 0)
+    assert asyncio.run(chain.ainvoke(input_obj)) == expected
+    assert chain.batch([input_obj, input_obj]) == [expected, expected]
+    # same as the other constructions
+    assert RunnableNLoop.unrolled(n, runnable, loopback).invoke(input_obj) == expected  # noqa
+    assert RunnableLoopback.with_n_loop(n, runnable, loopback).invoke(input_obj) == expected  # noqa
+
+    assert chain.InputType == runnable.InputType
+    assert chain.OutputType == runnable.OutputType
+    chain.get_graph()
+
+
+def test_runnable_n_loop_with_negative_n():
+    with pytest.raises(ValueError):
+        RunnableNLoop(-1, RunnablePassthrough(), RunnablePassthrough())
+    with pytest.raises(ValueError):
+        RunnableNLoop.unrolled(-1, RunnablePassthrough(), RunnablePassthrough())  # noqa
+
+
+@pytest.mark.parametrize(
+    'func, expected, expected_call_count',
+    [
+        # fixed point: 1 -> 2 -> 3 -> 3
+        (lambda x: min(x + 1, 3), 3, 4),
+        # cycle: 1 -> 2 -> 0 -> 1
+        (lambda x: (x + 1) % 3, 1, 4),
+    ]
+)
+def test_runnable_loopback_with_fingerprint(
+    func,
+    expected: int,
+    expected_call_count: int,
+    mocker,
+):
+    runnable: Runnable[int, int] = RunnableLambda(func)
+    runnable_invoke_spy = mocker.spy(runnable, 'invoke')
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=runnable,
+        condition=lambda x: True,
+        loopback=RunnablePassthrough(),
+        engine='native',
+        fingerprint=lambda x: x,
+    )
+    assert chain.invoke(0) == expected
+    assert runnable_invoke_spy.call_count == expected_call_count
+    assert asyncio.run(chain.ainvoke(0)) == expected
+    assert [i for i, _ in chain.stream_iterations(0)] == list(range(expected_call_count))  # noqa
+
+    chain = RunnableLoopback(
+        runnable=runnable,
+        condition=lambda x: True,
+        loopback=RunnablePassthrough(),
+        engine='native',
+        fingerprint=lambda x: x,
+        on_repeat='raise',
+    )
+    with pytest.raises(LoopbackCycleError):
+        chain.invoke(0)
+    with pytest.raises(LoopbackCycleError):
+        asyncio.run(chain.ainvoke(0))
+
+
+@pytest.mark.parametrize(
+    'max_fingerprints, expected_call_count',
+    [
+        (2, 10),
+        (3, 4),
+    ]
+)
+def test_runnable_loopback_with_max_fingerprints(
+    max_fingerprints: int,
+    expected_call_count: int,
+    mocker,
+):
+    runnable: Runnable[int, int] = RunnableLambda(lambda x: (x + 1) % 3)
+    runnable_invoke_spy = mocker.spy(runnable, 'invoke')
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=runnable,
+        condition=lambda x: runnable_invoke_spy.call_count < 10,
+        loopback=RunnablePassthrough(),
+        engine='native',
+        fingerprint=lambda x: x,
+        max_fingerprints=max_fingerprints,
+    )
+    chain.invoke(0)
+    assert runnable_invoke_spy.call_count == expected_call_count
+
+
+def test_runnable_loopback_with_memoized_loopback(mocker):
+    loopback: Runnable[int, int] = RunnableLambda(lambda x: x * 2)
+    loopback_invoke_spy = mocker.spy(loopback, 'invoke')
+    loopback_ainvoke_spy = mocker.spy(loopback, 'ainvoke')
+    chain: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=RunnableLambda(lambda x: x + 1),
+        condition=lambda x: x < 10,
+        loopback=loopback,
+        engine='native',
+        fingerprint=lambda x: x,
+        memoize_loopback=True,
+    )
+    # 0 -> 1 -> 2 -> 3 -> 6 -> 7 -> 14 -> 15
+    assert chain.invoke(0) == 15
+    assert loopback_invoke_spy.call_count == 3
+    assert chain.invoke(0) == 15
+    assert asyncio.run(chain.ainvoke(0)) == 15
+    assert loopback_invoke_spy.call_count == 3
+    assert loopback_ainvoke_spy.call_count == 0
+    # 2 -> 3 (memorized) -> 6 -> 7 (memorized) -> 14 -> 15
+    assert asyncio.run(chain.ainvoke(2)) == 15
+    assert loopback_ainvoke_spy.call_count == 0
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(fingerprint=str),
+        dict(fingerprint=str, engine='native', batch_mode='lockstep'),
+        dict(fingerprint=str, engine='native', max_fingerprints=0),
+        dict(fingerprint=str, engine='native', on_repeat='invalid'),
+        dict(engine='native', memoize_loopback=True),
+    ]
+)
+def test_runnable_loopback_with_invalid_fingerprint(kwargs: dict):
+    with pytest.raises(ValueError):
+        RunnableLoopback(
+            runnable=RunnablePassthrough(),
+            condition=lambda x: False,
+            loopback=RunnablePassthrough(),
+            **kwargs,
+        )
+
+
+def test_runnable_loopback_compiles_graph_lazily_and_shares_it():
+    def make(checkpointer=None) -> RunnableLoopback[int, int]:
+        return RunnableLoopback(
+            runnable=RunnableLambda(lambda x: x+1),
+            condition=lambda x: x < 3,
+            loopback=RunnablePassthrough(),
+            checkpointer=checkpointer,
+        )
+
+    chain1, chain2 = make(), make()
+    assert '_graph' not in vars(chain1)
+    assert chain1.invoke(0) == 3
+    assert '_graph' in vars(chain1)
+    assert chain1._graph is chain2._graph
+    assert make(InMemorySaver())._graph is not chain1._graph
+
+
+@pytest.mark.parametrize('engine', ['graph', 'native'])
+def test_runnable_loopback_nested(engine: str):
+    inner: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=RunnableLambda(lambda x: x+1),
+        condition=lambda x: x % 3 != 0,
+        loopback=RunnablePassthrough(),
+        engine=engine,  # type: ignore
+    )
+    outer: RunnableLoopback[int, int] = RunnableLoopback(
+        runnable=inner,
+        condition=lambda x: x < 10,
+        loopback=RunnableLambda(lambda x: x+1),
+        engine=engine,  # type: ignore
+    )
+    # 0 -> 3 -> 4 -> 6 -> 7 -> 9 -> 10 -> 12
+    assert outer.invoke(0) == 12
+    assert asyncio.run(outer.ainvoke(0)) == 12
+
+
+class _FakeExpander(Runnable[int, int]):
+    '''Fake of a stochastic runnable which expands `x` into
+    `10 * x + j` for the j-th expansion of the same input in a batch.
+    '''
+
+    def __init__(self, n_expansions: int):
+        self.n_expansions = n_expansions
+        self.batch_sizes: list[int] = []
+
+    def invoke(
+        self,
+        input: int,
+        config: RunnableConfig | None = None,
+        **kwargs: Any,
+    ) -> int:
+        raise NotImplementedError
+
+    def batch(  # type: ignore[override]
+        self,
+        inputs: list[int],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        **kwargs: Any,
+    ) -> list[int]:
+        self.batch_sizes.append(len(inputs))
+        return [10 * x + j % self.n_expansions for j, x in enumerate(inputs)]
+
+    async def abatch(  # type: ignore[override]
+        self,
+        inputs: list[int],
+        config: RunnableConfig | list[RunnableConfig] | None = None,
+        **kwargs: Any,
+    ) -> list[int]:
+        return self.batch(inputs, config, **kwargs)
+
+
+@pytest.mark.parametrize(
+    'beam_width, n_expansions, max_depth, score, expected, expected_batch_sizes',  # noqa
+    [
+        # 1 -> [12, 11] -> [122, 121]
+        (2, 3, 2, float, [122, 121], [3, 6]),
+        # 1 -> [11] -> [111] -> [1111]
+        (1, 2, 3, float, [1111], [2, 2, 2]),
+        # the ties keep the order of the outputs
+        (3, None, 2, lambda x: 0.0, [100, 101, 102], [3, 9]),
+    ]
+)
+def test_runnable_beam_search(
+    beam_width: int,
+    n_expansions: int | None,
+    max_depth: int,
+    score: Any,
+    expected: list[int],
+    expected_batch_sizes: list[int],
+    mocker,
+):
+    expander = _FakeExpander(n_expansions or beam_width)
+    scorer: Runnable[int, float] = RunnableLambda(score)
+    loopback: Runnable[int, int] = RunnableLambda(lambda x: x)
+    scorer_batch_spy = mocker.spy(scorer, 'batch')
+    loopback_batch_spy = mocker.spy(loopback, 'batch')
+    chain: RunnableBeamSearch[int, int] = RunnableBeamSearch(
+        runnable=expander,
+        scorer=scorer,
+        loopback=loopback,
+        beam_width=beam_width,
+        max_depth=max_depth,
+        n_expansions=n_expansions,
+    )
+    assert chain.invoke(1) == expected
+    assert expander.batch_sizes == expected_batch_sizes
+    assert scorer_batch_spy.call_count == max_depth
+    assert loopback_batch_spy.call_count == max_depth - 1
+    assert asyncio.run(chain.ainvoke(1)) == expected
+
+    assert chain.InputType == expander.InputType
+    assert chain.OutputType == list[expander.OutputType]  # type: ignore
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(beam_width=0, max_depth=1),
+        dict(beam_width=1, max_depth=0),
+        dict(beam_width=1, max_depth=1, n_expansions=0),
+    ]
+)
+def test_runnable_beam_search_with_invalid_args(kwargs: dict):
+    with pytest.raises(ValueError):
+        RunnableBeamSearch(
+            runnable=RunnablePassthrough(),
+            scorer=lambda x: 0.0,
+            loopback=RunnablePassthrough(),
+            **kwargs,
+        )
@@ -1,7 +1,20 @@
-from typing import Callable
-from langchain_core.runnables import Runnable, RunnableLambda
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from itertools import cycle
+import operator
+import random
+import threading
+import time
+from typing import Any, Callable, Iterator
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 import pytest
-from runnable_family.random import RunnableRandomBranch
+from runnable_family.random import (
+    SEED_CONFIG_KEY,
+    BlockRandom,
+    RunnableRandomBranch,
+)
 
 
 runnables: list[Runnable[int, int] | Callable[[int], int]] = [
@@ -116,3 +129,647 @@ def test_runnable_random_branch_with_negative_probability(probs: list[float]):
     # run test
     with pytest.raises(ValueError):
         RunnableRandomBranch(*runnables, probs=probs)
+
+
+@pytest.mark.parametrize(
+    'random_value, expected',
+    [
+        (0.0, 0),
+        (0.3, 1),
+        (0.75, 2),
+        (1.0, 3),
+    ]
+)
+def test_runnable_random_branch_invokes_only_selected_runnable(
+    random_value: float,
+    expected: int,
+    mocker,
+):
+    branches: list[Runnable[int, int]] = [
+        RunnableLambda(partial(operator.add, i)) for i in range(4)
+    ]
+    spies = [mocker.spy(branch, 'invoke') for branch in branches]
+    chain = RunnableRandomBranch(
+        *branches,
+        generate_random_value=lambda: random_value,
+    )
+    assert chain.invoke(0) == expected
+    assert [spy.call_count for spy in spies] == [
+        int(i == expected) for i in range(4)
+    ]
+    assert asyncio.run(chain.ainvoke(0)) == expected
+    assert list(chain.stream(0)) == [expected]
+
+    async def main() -> list[int]:
+        return [chunk async for chunk in chain.astream(0)]
+
+    assert asyncio.run(main()) == [expected]
+    assert chain.batch([0, 1]) == [expected, expected + 1]
+
+
+def test_runnable_random_branch_with_many_runnables():
+    k = 1000
+    chain = RunnableRandomBranch(
+        *[RunnableLambda(lambda x, i=i: i) for i in range(k)],
+        generate_random_value=iter([0.0, 0.0015, 0.5, 0.9995, 1.0]).__next__,
+    )
+    assert [chain.invoke(0) for _ in range(5)] == [0, 1, 499, 999, 999]
+
+
+def test_runnable_random_branch_streams_selected_runnable():
+    def generate(x: str) -> Iterator[str]:
+        yield from x
+
+    chain = RunnableRandomBranch(
+        RunnableLambda(generate),
+        RunnableLambda(lambda x: x.upper()),
+        generate_random_value=lambda: 0.0,
+    )
+    assert list(chain.stream('abc')) == ['a', 'b', 'c']
+
+
+def test_runnable_random_branch_batch_groups_inputs(mocker):
+    branches: list[Runnable[int, int]] = [
+        RunnableLambda(partial(operator.add, 100 * i)) for i in range(4)
+    ]
+    batch_spies = [mocker.spy(branch, 'batch') for branch in branches]
+    abatch_spies = [mocker.spy(branch, 'abatch') for branch in branches]
+    chain = RunnableRandomBranch(
+        *branches,
+        probs=[0.5, 0.25, 0.25, 0.0],
+        generate_random_value=cycle([0.1, 0.6, 0.9]).__next__,
+    )
+    inputs = list(range(999))
+    expected = [x + 100 * (x % 3) for x in inputs]
+    assert chain.batch(inputs) == expected
+    assert [spy.call_count for spy in batch_spies] == [1, 1, 1, 0]
+    assert [
+        spy.call_args.args[0] for spy in batch_spies[:3]
+    ] == [inputs[i::3] for i in range(3)]
+    assert asyncio.run(chain.abatch(inputs)) == expected
+    assert [spy.call_count for spy in abatch_spies] == [1, 1, 1, 0]
+    assert chain.batch([]) == []
+
+
+class _InFlightCounter:
+    '''Sync and async functions counting how many calls are in flight.'''
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.current = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _enter(self) -> None:
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def _exit(self) -> None:
+        with self.lock:
+            self.current -= 1
+
+    def __call__(self, x: int) -> int:
+        self._enter()
+        time.sleep(self.delay)
+        self._exit()
+        return x
+
+    async def acall(self, x: int) -> int:
+        self._enter()
+        await asyncio.sleep(self.delay)
+        self._exit()
+        return x
+
+
+def test_runnable_random_branch_batch_keeps_max_concurrency():
+    counter = _InFlightCounter()
+    chain = RunnableRandomBranch(
+        *[RunnableLambda(counter, afunc=counter.acall) for _ in range(4)],
+        generate_random_value=cycle([0.1, 0.3, 0.6, 0.9]).__next__,
+    )
+    inputs = list(range(40))
+    config: RunnableConfig = {'max_concurrency': 2}
+    assert chain.batch(inputs, config) == inputs
+    assert counter.peak == 2
+    counter.peak = 0
+    assert asyncio.run(chain.abatch(inputs, config)) == inputs
+    assert counter.peak == 2
+
+
+def test_runnable_random_branch_batch_with_exceptions():
+    def fail(x: int) -> int:
+        raise RuntimeError('error')
+
+    chain = RunnableRandomBranch(
+        lambda x: x,
+        fail,
+        generate_random_value=cycle([0.1, 0.9]).__next__,
+    )
+    actual = chain.batch([0, 1, 2], return_exceptions=True)
+    assert actual[0] == 0
+    assert isinstance(actual[1], RuntimeError)
+    assert actual[2] == 2
+    with pytest.raises(RuntimeError):
+        chain.batch([0, 1, 2])
+    actual = asyncio.run(chain.abatch([0, 1, 2], return_exceptions=True))
+    assert actual[0] == 0
+    assert isinstance(actual[1], RuntimeError)
+    assert actual[2] == 2
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 256])
+@pytest.mark.parametrize('sizes', [[1] * 10, [4, 0, 1, 5], [10]])
+def test_block_random(block_size: int, sizes: list[int]):
+    generator = BlockRandom(seed=42, block_size=block_size)
+    reference = random.Random(42)
+    for size in sizes:
+        assert generator.draw(size) == [reference.random() for _ in range(size)]  # noqa
+    assert generator() == reference.random()
+
+
+def test_block_random_is_thread_safe():
+    generator = BlockRandom(seed=0, block_size=7)
+    n_threads, n_draws = 8, 500
+    drawn: list[list[float]] = [[] for _ in range(n_threads)]
+
+    def draw(i: int) -> None:
+        for _ in range(n_draws):
+            drawn[i].append(generator())
+
+    threads = [
+        threading.Thread(target=draw, args=(i,)) for i in range(n_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    reference = random.Random(0)
+    assert sorted(sum(drawn, [])) == sorted(
+        reference.random() for _ in range(n_threads * n_draws)
+    )
+
+
+def test_block_random_with_invalid_block_size():
+    with pytest.raises(ValueError):
+        BlockRandom(block_size=0)
+
+
+def test_runnable_random_branch_with_seed():
+    def make(seed: int | None = None) -> RunnableRandomBranch[int, int]:
+        return RunnableRandomBranch(*runnables, seed=seed)
+
+    inputs = [0] * 50
+    chain = make(0)
+    expected = [chain.invoke(x) for x in inputs]
+    # reproducible by the seed of the instance
+    chain = make(0)
+    assert [chain.invoke(x) for x in inputs] == expected
+    assert make(0).batch(inputs) == expected
+    assert asyncio.run(make(0).abatch(inputs)) == expected
+    assert make(1).batch(inputs) != expected
+    # reproducible by the seed per call
+    config: RunnableConfig = {'configurable': {SEED_CONFIG_KEY: 0}}
+    chain = make()
+    assert [chain.invoke(0, config) for _ in range(3)] == [expected[0]] * 3
+    assert chain.batch(inputs, config) == expected
+    assert make(1).batch(inputs, config) == expected
+
+
+def test_runnable_random_branch_nested_with_seed():
+    chain: RunnableRandomBranch[int, str] = RunnableRandomBranch(
+        lambda x: 'a',
+        RunnableRandomBranch(lambda x: 'c', lambda x: 'd'),
+    )
+    configs: list[RunnableConfig] = [
+        {'configurable': {SEED_CONFIG_KEY: seed}} for seed in range(50)
+    ]
+    expected = [chain.invoke(0, config) for config in configs]
+    # the inner branch does not reuse the value drawn by the outer one
+    assert set(expected) == {'a', 'c', 'd'}
+    assert [chain.invoke(0, config) for config in configs] == expected
+    assert chain.batch([0] * 50, configs[0])[0] == expected[0]
+    # the inputs of a batch get distinct seeds for the inner branch
+    assert set(chain.batch([0] * 50, configs[0])) == {'a', 'c', 'd'}
+
+
+def test_runnable_random_branch_with_seed_and_generate_random_value():
+    with pytest.raises(ValueError):
+        RunnableRandomBranch(
+            *runnables,
+            seed=0,
+            generate_random_value=random.random,
+        )
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize(
+    'probs',
+    [
+        [0.25, 0.25, 0.25, 0.25],
+        [0.5, 0.3, 0.2, 0.0],
+        [0.01, 0.09, 0.4, 0.5],
+    ]
+)
+def test_runnable_random_branch_frequencies(seed: int, probs: list[float]):
+    n = 2000
+    chain = RunnableRandomBranch(*runnables, probs=probs, seed=seed)
+    counts = Counter(chain.batch([0] * n))
+    # chi-squared test over the branches with positive probabilities
+    chi2 = sum(
+        (counts[i] - n * p) ** 2 / (n * p)
+        for i, p in enumerate(probs)
+        if p > 0
+    )
+    # NOTE: the critical value at the significance level 0.001 with 3 dof
+    assert chi2 < 16.27
+    assert all(counts[i] == 0 for i, p in enumerate(probs) if p == 0)
+
+
+def _sleep_and_return(x: int, delay: float, output: int) -> int:
+    time.sleep(delay)
+    return output
+
+
+async def _async_sleep_and_return(x: int, delay: float, output: int) -> int:
+    await asyncio.sleep(delay)
+    return output
+
+
+def test_runnable_random_branch_adaptive_routing_prefers_fast_runnable():
+    chain = RunnableRandomBranch(
+        RunnableLambda(partial(_sleep_and_return, delay=0.02, output=0)),
+        RunnableLambda(partial(_sleep_and_return, delay=0.001, output=1)),
+        seed=0,
+        routing='adaptive',
+        exploration=0.1,
+    )
+    assert chain.probs == pytest.approx([0.5, 0.5])
+    counts = Counter(chain.invoke(0) for _ in range(50))
+    assert counts[1] > counts[0]
+    probs = chain.probs
+    assert probs[1] > 0.8
+    # the slow runnable keeps the floor
+    assert probs[0] >= 0.1 * 0.5
+    assert sum(probs) == pytest.approx(1.0)
+
+
+def test_runnable_random_branch_adaptive_routing_async():
+    chain = RunnableRandomBranch(
+        RunnableLambda(
+            partial(_sleep_and_return, delay=0.02, output=0),
+            afunc=partial(_async_sleep_and_return, delay=0.02, output=0),
+        ),
+        RunnableLambda(
+            partial(_sleep_and_return, delay=0.001, output=1),
+            afunc=partial(_async_sleep_and_return, delay=0.001, output=1),
+        ),
+        seed=0,
+        routing='adaptive',
+    )
+
+    async def main() -> None:
+        for _ in range(30):
+            await chain.ainvoke(0)
+
+    asyncio.run(main())
+    assert chain.probs[1] > 0.8
+
+
+def test_runnable_random_branch_adaptive_routing_avoids_errors():
+    def fail(x: int) -> int:
+        raise RuntimeError('error')
+
+    chain = RunnableRandomBranch(
+        lambda x: x,
+        fail,
+        probs=[0.5, 0.5],
+        seed=0,
+        routing='adaptive',
+        exploration=0.2,
+    )
+    for _ in range(20):
+        try:
+            chain.invoke(0)
+        except RuntimeError:
+            pass
+    assert chain.probs == pytest.approx([0.9, 0.1])
+    # the errors in batch are counted per input
+    chain = RunnableRandomBranch(
+        lambda x: x,
+        fail,
+        seed=0,
+        routing='adaptive',
+        exploration=0.2,
+    )
+    chain.batch([0] * 20, return_exceptions=True)
+    assert chain.probs == pytest.approx([0.9, 0.1])
+
+
+def test_runnable_random_branch_static_routing_keeps_probs():
+    chain = RunnableRandomBranch(
+        RunnableLambda(partial(_sleep_and_return, delay=0.01, output=0)),
+        lambda x: 1,
+        probs=[0.3, 0.7],
+        seed=0,
+    )
+    chain.batch([0] * 10)
+    assert chain.probs == pytest.approx([0.3, 0.7])
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        {'routing': 'unknown'},
+        {'routing': 'adaptive', 'exploration': -0.1},
+        {'routing': 'adaptive', 'exploration': 1.1},
+        {'routing': 'adaptive', 'smoothing': 0.0},
+        {'routing': 'adaptive', 'smoothing': 1.1},
+        {'hedge_after': -0.1},
+        {'hedge_after': 'auto', 'hedge_percentile': 1.0},
+        {'hedge_after': 'auto', 'hedge_window': 1},
+    ]
+)
+def test_runnable_random_branch_with_invalid_routing(kwargs: dict[str, Any]):
+    with pytest.raises(ValueError):
+        RunnableRandomBranch(*runnables, **kwargs)
+
+
+def _wait_and_return(x: int, event: threading.Event, output: int) -> int:
+    # NOTE: the timeout only guards the test from hanging
+    assert event.wait(10)
+    return output
+
+
+def test_runnable_random_branch_hedges_slow_runnable():
+    release = threading.Event()
+    chain = RunnableRandomBranch(
+        RunnableLambda(partial(_wait_and_return, event=release, output=0)),
+        RunnableLambda(lambda x: 1),
+        generate_random_value=cycle([0.1, 0.9]).__next__,
+        hedge_after=0.0,
+    )
+    try:
+        assert chain.invoke(0) == 1
+    finally:
+        release.set()
+    assert chain.hedge_metrics == {'requests': 1, 'hedged': 1, 'hedge_won': 1}  # noqa
+    # the fast runnable answers without hedging
+    chain = RunnableRandomBranch(
+        RunnableLambda(lambda x: 0),
+        RunnableLambda(lambda x: 1),
+        generate_random_value=lambda: 0.9,
+        hedge_after=10.0,
+    )
+    assert chain.invoke(0) == 1
+    assert chain.hedge_metrics == {'requests': 1, 'hedged': 0, 'hedge_won': 0}  # noqa
+
+
+def test_runnable_random_branch_runs_inline_without_hedge():
+    chain = RunnableRandomBranch(
+        RunnableLambda(lambda x: threading.current_thread()),
+        probs=[1.0],
+        hedge_after=0.0,
+    )
+    assert chain.invoke(0) is threading.current_thread()
+    assert not chain._hedge_threads
+
+
+def test_runnable_random_branch_hedges_under_concurrent_load():
+    # NOTE: more slow calls than the workers of a default thread pool
+    n_calls = 64
+    release = threading.Event()
+    chain = RunnableRandomBranch(
+        RunnableLambda(partial(_wait_and_return, event=release, output=0)),
+        RunnableLambda(lambda x: 1),
+        generate_random_value=lambda: 0.0,
+        hedge_after=0.0,
+    )
+    with ThreadPoolExecutor(max_workers=n_calls) as executor:
+        try:
+            futures = [executor.submit(chain.invoke, 0) for _ in range(n_calls)]  # noqa
+            # every hedge answers while all the selected ones are blocked
+            done, _ = wait(futures, timeout=10)
+            assert len(done) == n_calls
+            assert [future.result() for future in futures] == [1] * n_calls
+        finally:
+            release.set()
+    assert chain.hedge_metrics == {
+        'requests': n_calls,
+        'hedged': n_calls,
+        'hedge_won': n_calls,
+    }
+    chain.close(timeout=10)
+    assert not chain._hedge_threads
+
+
+def test_runnable_random_branch_close_stops_hedging():
+    release = threading.Event()
+    chain = RunnableRandomBranch(
+        RunnableLambda(partial(_wait_and_return, event=release, output=0)),
+        RunnableLambda(lambda x: 1),
+        generate_random_value=lambda: 0.0,
+        hedge_after=0.0,
+    )
+    assert chain.invoke(0) == 1
+    # the loser is still running in the background
+    assert len(chain._hedge_threads) == 1
+    chain.close(timeout=0.0)
+    assert len(chain._hedge_threads) == 1
+    release.set()
+    chain.close()
+    assert not chain._hedge_threads
+    # the selected one runs inline without hedging after close
+    assert chain.invoke(0) == 0
+    assert chain.hedge_metrics == {'requests': 2, 'hedged': 1, 'hedge_won': 1}  # noqa
+
+
+def test_runnable_random_branch_hedges_and_cancels_loser_async():
+    cancelled: list[bool] = []
+
+    async def slow(x: int) -> int:
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return 0
+
+    chain: RunnableRandomBranch[int, int] = RunnableRandomBranch(
+        RunnableLambda(lambda x: 0, afunc=slow),
+        RunnableLambda(lambda x: 1),
+        generate_random_value=cycle([0.1, 0.9]).__next__,
+        hedge_after=0.0,
+    )
+
+    async def main() -> int:
+        output = await chain.ainvoke(0)
+        # let the loop deliver the cancellation
+        for _ in range(10):
+            if cancelled:
+                break
+            await asyncio.sleep(0)
+        return output
+
+    assert asyncio.run(main()) == 1
+    assert cancelled == [True]
+    assert chain.hedge_metrics == {'requests': 1, 'hedged': 1, 'hedge_won': 1}  # noqa
+
+
+def test_runnable_random_branch_hedges_with_learned_threshold():
+    release = threading.Event()
+    release.set()
+    chain = RunnableRandomBranch(
+        partial(_wait_and_return, event=release, output=0),
+        lambda x: 1,
+        generate_random_value=lambda: 0.0,
+        hedge_after='auto',
+    )
+    # no hedging until the latencies are learned
+    assert [chain.invoke(0) for _ in range(10)] == [0] * 10
+    assert chain.hedge_metrics['hedged'] == 0
+    release.clear()
+    try:
+        assert chain.invoke(0) == 1
+    finally:
+        release.set()
+    assert chain.hedge_metrics == {'requests': 11, 'hedged': 1, 'hedge_won': 1}  # noqa
+
+
+def test_runnable_random_branch_hedges_with_errors():
+    hedge_failed = threading.Event()
+
+    def fail_fast(x: int) -> int:
+        hedge_failed.set()
+        raise RuntimeError('fast')
+
+    def fail_after_hedge(x: int) -> int:
+        assert hedge_failed.wait(10)
+        raise RuntimeError('slow')
+
+    chain = RunnableRandomBranch(
+        fail_fast,
+        lambda x: 1,
+        generate_random_value=lambda: 0.0,
+        hedge_after=10.0,
+    )
+    with pytest.raises(RuntimeError, match='fast'):
+        chain.invoke(0)
+    # the error of the selected one is raised if all the runs fail
+    chain = RunnableRandomBranch(
+        fail_after_hedge,
+        fail_fast,
+        generate_random_value=lambda: 0.0,
+        hedge_after=0.0,
+    )
+    hedge_failed.clear()
+    with pytest.raises(RuntimeError, match='slow'):
+        chain.invoke(0)
+    hedge_failed.clear()
+    with pytest.raises(RuntimeError, match='slow'):
+        asyncio.run(chain.ainvoke(0))
+    assert chain.hedge_metrics == {'requests': 2, 'hedged': 2, 'hedge_won': 0}  # noqa
+    # the successful hedge wins over the failed one
+    release = threading.Event()
+
+    def fail_on_release(x: int) -> int:
+        assert release.wait(10)
+        raise RuntimeError('slow')
+
+    chain = RunnableRandomBranch(
+        fail_on_release,
+        lambda x: 1,
+        generate_random_value=lambda: 0.0,
+        hedge_after=0.0,
+    )
+    try:
+        assert chain.invoke(0) == 1
+    finally:
+        release.set()
+
+
+def _make_sticky(probs: list[float]) -> RunnableRandomBranch[dict[str, str], int]:  # noqa
+    return RunnableRandomBranch(
+        *[
+            RunnableLambda(partial(lambda i, x: i, i))
+            for i in range(len(probs))
+        ],
+        probs=probs,
+        routing='sticky',
+        key=operator.itemgetter('user'),
+    )
+
+
+def test_runnable_random_branch_sticky_routing():
+    chain = _make_sticky([0.25, 0.25, 0.25, 0.25])
+    inputs = [{'user': f'user-{i % 10}'} for i in range(40)]
+    expected = [chain.invoke(x) for x in inputs]
+    assert expected[:10] * 4 == expected
+    assert len(set(expected)) > 1
+    # identical keys hit the same runnable in every method and instance
+    assert _make_sticky([0.25] * 4).batch(inputs) == expected
+    assert asyncio.run(chain.abatch(inputs)) == expected
+    assert [list(chain.stream(x)) for x in inputs[:10]] == [[y] for y in expected[:10]]  # noqa
+
+    async def main() -> list[list[int]]:
+        return [[y async for y in chain.astream(x)] for x in inputs[:10]]
+
+    assert asyncio.run(main()) == [[y] for y in expected[:10]]
+
+
+def test_runnable_random_branch_sticky_routing_frequencies():
+    n = 4000
+    probs = [0.5, 0.3, 0.2, 0.0]
+    chain = _make_sticky(probs)
+    counts = Counter(chain.batch([{'user': str(i)} for i in range(n)]))
+    chi2 = sum(
+        (counts[i] - n * p) ** 2 / (n * p)
+        for i, p in enumerate(probs)
+        if p > 0
+    )
+    # NOTE: the critical value at the significance level 0.001 with 2 dof
+    assert chi2 < 13.82
+    assert counts[3] == 0
+
+
+def test_runnable_random_branch_sticky_routing_is_consistent():
+    inputs = [{'user': str(i)} for i in range(1000)]
+    before = _make_sticky([0.5, 0.5, 0.0]).batch(inputs)
+    after = _make_sticky([0.4, 0.4, 0.2]).batch(inputs)
+    moved = [(b, a) for b, a in zip(before, after) if b != a]
+    # only the keys moving to the new runnable are remapped
+    assert moved
+    assert all(a == 2 for _, a in moved)
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        {'routing': 'sticky'},
+        {'key': str},
+        {'routing': 'adaptive', 'key': str},
+    ]
+)
+def test_runnable_random_branch_with_invalid_key(kwargs: dict[str, Any]):
+    with pytest.raises(ValueError):
+        RunnableRandomBranch(*runnables, **kwargs)
+
+
+@pytest.mark.parametrize('max_concurrency', [1, None])
+def test_runnable_random_branch_adaptive_routing_with_uneven_groups(
+    max_concurrency: int | None,
+):
+    chain = RunnableRandomBranch(
+        RunnableLambda(partial(_sleep_and_return, delay=0.01, output=0)),
+        RunnableLambda(partial(_sleep_and_return, delay=0.01, output=1)),
+        probs=[0.8, 0.2],
+        generate_random_value=cycle([0.1, 0.2, 0.3, 0.4, 0.9]).__next__,
+        routing='adaptive',
+    )
+    config: RunnableConfig = {'max_concurrency': max_concurrency}
+    assert Counter(chain.batch([0] * 20, config)) == {0: 16, 1: 4}
+    # the identical runnables keep the configured probabilities
+    # regardless of the sizes of the groups
+    assert chain.probs == pytest.approx([0.8, 0.2], abs=0.1)
+    assert Counter(asyncio.run(chain.abatch([0] * 20, config))) == {0: 16, 1: 4}  # noqa
+    assert chain.probs == pytest.approx([0.8, 0.2], abs=0.1)
@@ -0,0 +1,90 @@
+from collections import Counter
+import math
+import statistics
+from typing import Any
+import pytest
+from runnable_family.reducers import (
+    CountReducer,
+    MeanVariance,
+    MeanVarianceReducer,
+    Reducer,
+    TopKReducer,
+)
+
+
+@pytest.mark.parametrize(
+    'values, key, expected',
+    [
+        ([], None, Counter()),
+        (['a', 'b', 'a'], None, Counter({'a': 2, 'b': 1})),
+        ([1, 2, 3, 4], lambda x: x % 2, Counter({0: 2, 1: 2})),
+    ]
+)
+def test_count_reducer(values, key, expected):
+    assert CountReducer(key=key).reduce(values) == expected
+
+
+def test_count_reducer_initial_is_fresh():
+    reducer: CountReducer[str] = CountReducer()
+    assert reducer.reduce(['a']) == Counter({'a': 1})
+    assert reducer.reduce(['a']) == Counter({'a': 1})
+
+
+@pytest.mark.parametrize(
+    'values, ddof',
+    [
+        ([1.0, 2.0, 3.0, 4.0], 0),
+        ([1.0, 2.0, 3.0, 4.0], 1),
+        ([0.5, -1.5, 10.0, 3.25, 3.25], 1),
+    ]
+)
+def test_mean_variance_reducer(values: list[float], ddof: int):
+    actual = MeanVarianceReducer(ddof=ddof).reduce(values)
+    assert actual.n == len(values)
+    assert math.isclose(actual.mean, statistics.mean(values))
+    if ddof == 0:
+        assert math.isclose(actual.variance, statistics.pvariance(values))
+    else:
+        assert math.isclose(actual.variance, statistics.variance(values))
+
+
+def test_mean_variance_reducer_without_enough_values():
+    actual = MeanVarianceReducer(ddof=1).reduce([1.0])
+    assert actual.n == 1
+    assert actual.mean == 1.0
+    assert math.isnan(actual.variance)
+
+
+@pytest.mark.parametrize(
+    'values, k, key, expected',
+    [
+        ([3, 1, 4, 1, 5], 2, None, [5, 4]),
+        ([3, 1, 4, 1, 5], 10, None, [5, 4, 3, 1, 1]),
+        (['aa', 'b', 'ccc'], 1, len, ['ccc']),
+        ([{'v': 1}, {'v': 1}, {'v': 0}], 2, lambda d: d['v'], [{'v': 1}, {'v': 1}]),  # noqa
+    ]
+)
+def test_top_k_reducer(values, k, key, expected):
+    assert TopKReducer(k, key=key).reduce(values) == expected
+
+
+def test_top_k_reducer_with_invalid_k():
+    with pytest.raises(ValueError):
+        TopKReducer(0)
+
+
+def test_reducer_requires_initial_and_fold():
+    with pytest.raises(TypeError):
+        Reducer()  # type: ignore[abstract]
+
+
+@pytest.mark.parametrize(
+    'reducer, expected',
+    [
+        (CountReducer(), Counter),
+        (MeanVarianceReducer(), MeanVariance),
+        (TopKReducer(2), Any),
+    ]
+)
+def test_reducer_result_type(reducer: Reducer[Any, Any, Any], expected: Any):
+    assert reducer.ResultType == expected
@@ -1,6 +1,8 @@
+import asyncio
+from itertools import count
 from langchain_core.runnables import RunnableLambda
 import pytest
-from typing import Iterable
+from typing import Callable, Iterable
 from runnable_family.runnable_diff import RunnableDiff
 
 
@@ -35,3 +37,67 @@ def test_runnable_diff(
     assert actual == expected
     assert chain.InputType == runnable1.InputType
     assert chain.OutputType == diff.OutputType
+
+
+def _counted(calls: list[int], func: Callable[[int], int]) -> RunnableLambda[int, int]:  # noqa
+    def wrapper(x: int) -> int:
+        calls.append(x)
+        return func(x)
+    return RunnableLambda(wrapper)
+
+
+def test_runnable_diff_runs_shared_prefix_once():
+    calls: list[int] = []
+    prefix = _counted(calls, lambda x: x * 10)
+    runnable1 = prefix | RunnableLambda(lambda x: x + 1) | RunnableLambda(lambda x: x * 2)  # noqa
+    runnable2 = prefix | RunnableLambda(lambda x: x - 1)
+    diff = RunnableLambda(lambda lst: lst[0] - lst[1])
+    chain = RunnableDiff(runnable1, runnable2, diff, share_prefix=True)
+    assert chain.invoke(1) == 22 - 9
+    assert calls == [1]
+    assert chain.batch([1, 2]) == [22 - 9, 42 - 19]
+    assert asyncio.run(chain.ainvoke(1)) == 22 - 9
+    # the prefix is not shared by default
+    calls.clear()
+    assert RunnableDiff(runnable1, runnable2, diff).invoke(1) == 22 - 9
+    assert calls == [1, 1]
+    # the last step is not shared even if one runnable is the prefix itself
+    calls.clear()
+    chain = RunnableDiff(prefix, runnable2, diff, share_prefix=True)
+    assert chain.invoke(1) == 1
+    assert calls == [1, 1]
+
+
+def test_runnable_diff_compares_samples_of_stochastic_runnable():
+    counter = count()
+    sample = RunnableLambda(lambda x: x + next(counter))
+    chain = RunnableLambda(lambda x: x) | sample
+    diff = RunnableLambda(lambda lst: lst[0] - lst[1])
+    for runnable in (sample, chain):
+        assert RunnableDiff(runnable, runnable, diff).invoke(0) != 0
+        # the sampling step is not shared even with share_prefix
+        assert RunnableDiff(runnable, runnable, diff, share_prefix=True).invoke(0) != 0  # noqa
+
+
+def test_runnable_diff_does_not_share_equal_but_distinct_steps():
+    calls: list[int] = []
+    chain = RunnableDiff(
+        _counted(calls, lambda x: x) | RunnableLambda(lambda x: x + 1),
+        _counted(calls, lambda x: x) | RunnableLambda(lambda x: x - 1),
+        RunnableLambda(lambda lst: lst[0] - lst[1]),
+        share_prefix=True,
+    )
+    assert chain.invoke(1) == 2
+    assert calls == [1, 1]
+
+
+def test_runnable_diff_with_shared():
+    calls: list[int] = []
+    chain = RunnableDiff(
+        RunnableLambda(lambda x: x + 1),
+        RunnableLambda(lambda x: x - 1),
+        RunnableLambda(lambda lst: lst[0] * lst[1]),
+        shared=_counted(calls, lambda x: x * 10),
+    )
+    assert chain.invoke(1) == 11 * 9
+    assert calls == [1]